@@ -0,0 +1,181 @@
+"""
+Benchmark the reverse complement implementations in this directory.
+
+Inputs are generated with benchmarks/fasta_no5.py, so they are the same on
+every run. For every implementation and input size the wall time, throughput,
+peak RSS and CPU utilisation are recorded. Results are written as JSON and
+can be compared against a stored baseline to catch regressions.
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FASTA = os.path.join(HERE, "benchmarks", "fasta_no5.py")
+
+IMPLEMENTATIONS = {
+    "reverse_complement": os.path.join(HERE, "reverse_complement.py"),
+    "revcomp_no2": os.path.join(HERE, "benchmarks", "revcomp_no2.py"),
+    "revcomp_no6": os.path.join(HERE, "benchmarks", "revcomp_no6.py"),
+    "Reverse-Complement": os.path.join(HERE, "benchmarks",
+                                       "Reverse-Complement.py"),
+}
+
+_SIZE_SUFFIXES = {"K": 10 ** 3, "M": 10 ** 6, "G": 10 ** 9}
+
+
+def parse_bases(size: str) -> int:
+    """Parse a number of bases such as '25M'."""
+    suffix = size[-1:].upper()
+    if suffix in _SIZE_SUFFIXES:
+        return int(float(size[:-1]) * _SIZE_SUFFIXES[suffix])
+    return int(size)
+
+
+def generate_input(bases: int, directory: str) -> str:
+    """
+    Generate an input of roughly bases with fasta_no5.py, which outputs ten
+    bases per unit of its argument. Inputs are reused between runs.
+    """
+    path = os.path.join(directory, f"revcomp-input-{bases}.fa")
+    if not os.path.exists(path):
+        partial = path + ".partial"
+        with open(partial, "wb") as out:
+            subprocess.run([sys.executable, FASTA, str(bases // 10)],
+                           stdout=out, check=True)
+        os.rename(partial, path)
+    return path
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as result:
+        for block in iter(lambda: result.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def run_once(script: str, input_path: str, output_path: str) -> Dict:
+    """Run one implementation and measure it with wait4."""
+    with open(input_path, "rb") as inp, open(output_path, "wb") as out:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, script],
+                                   stdin=inp, stdout=out)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"{script} exited with {process.returncode}")
+    cpu_time = usage.ru_utime + usage.ru_stime
+    input_size = os.path.getsize(input_path)
+    return {
+        "wall_time": wall_time,
+        "mb_per_second": input_size / wall_time / 10 ** 6,
+        # ru_maxrss is in kilobytes on Linux.
+        "peak_rss_mb": usage.ru_maxrss / 1024,
+        "cpu_time": cpu_time,
+        "cpu_utilisation": cpu_time / wall_time,
+    }
+
+
+def benchmark(implementations: List[str], sizes: List[int], repeats: int,
+              directory: str) -> Dict:
+    results = {}
+    for bases in sizes:
+        input_path = generate_input(bases, directory)
+        output_path = os.path.join(directory, "revcomp-output.fa")
+        reference = None
+        for name in implementations:
+            runs = [run_once(IMPLEMENTATIONS[name], input_path, output_path)
+                    for _ in range(repeats)]
+            best = min(runs, key=lambda run: run["wall_time"])
+            # All implementations should agree with the first one.
+            digest = _sha256(output_path)
+            reference = reference or digest
+            best["output_matches"] = digest == reference
+            results.setdefault(name, {})[str(bases)] = best
+            print(f"{name:>20} {bases:>12} {best['wall_time']:8.3f}s "
+                  f"{best['mb_per_second']:8.1f}MB/s "
+                  f"{best['peak_rss_mb']:8.1f}MB "
+                  f"{best['cpu_utilisation']:6.0%}"
+                  f"{'' if best['output_matches'] else ' WRONG OUTPUT'}",
+                  file=sys.stderr)
+        os.remove(output_path)
+    return results
+
+
+def find_regressions(results: Dict, baseline: Dict, tolerance: float
+                     ) -> List[str]:
+    """Compare the wall times and outputs against the baseline results."""
+    regressions = []
+    for name, sizes in results["results"].items():
+        for bases, result in sizes.items():
+            base = baseline["results"].get(name, {}).get(bases)
+            if not result["output_matches"]:
+                regressions.append(f"{name} {bases}: wrong output")
+            if base is None:
+                continue
+            if result["wall_time"] > base["wall_time"] * (1 + tolerance):
+                regressions.append(
+                    f"{name} {bases}: {result['wall_time']:.3f}s vs "
+                    f"{base['wall_time']:.3f}s in baseline")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", nargs="+", default=["25M", "100M", "250M"],
+                        help="Input sizes in bases. Default: 25M 100M 250M.")
+    parser.add_argument("--implementations", nargs="+",
+                        choices=list(IMPLEMENTATIONS),
+                        default=list(IMPLEMENTATIONS),
+                        help="Default: all of them.")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="Best of this many runs is used. Default: 3.")
+    parser.add_argument("--directory",
+                        default=os.path.join(tempfile.gettempdir(),
+                                             "revcomp-benchmark"),
+                        help="Where generated inputs are kept. "
+                             "Default: %(default)s.")
+    parser.add_argument("-o", "--output", default="bench_output.json",
+                        help="JSON file for the results. "
+                             "Default: %(default)s.")
+    parser.add_argument("--baseline",
+                        help="JSON results of an earlier run to compare to.")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Allowed slowdown relative to the baseline. "
+                             "Default: 0.1.")
+    args = parser.parse_args(argv)
+    os.makedirs(args.directory, exist_ok=True)
+    results = {
+        "host": socket.gethostname(),
+        "cpu_count": os.cpu_count(),
+        "python": sys.version.split()[0],
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "results": benchmark(args.implementations,
+                             [parse_bases(size) for size in args.sizes],
+                             args.repeats, args.directory),
+    }
+    with open(args.output, "wt") as output:
+        json.dump(results, output, indent=2)
+    if args.baseline:
+        with open(args.baseline, "rt") as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
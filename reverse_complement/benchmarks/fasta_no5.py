@@ -6,9 +6,11 @@
 from bisect import bisect
 from contextlib import closing, contextmanager
 from itertools import accumulate, chain, islice, zip_longest
+from math import lcm
 from multiprocessing import Lock, RawValue, Process
-from os import cpu_count
+from os import O_APPEND, SEEK_CUR, SEEK_SET, cpu_count, fstat, lseek
 from re import sub
+from stat import S_ISREG
 from sys import argv, stdout
 
 write = stdout.buffer.write
@@ -23,6 +25,39 @@ def started_process(target, args):
     process.start()
     return process
 
+def positional_output():
+    try:
+        from fcntl import F_GETFL, fcntl
+        from os import pwrite
+    except ImportError:
+        return None
+    try:
+        fd = stdout.fileno()
+    except (AttributeError, OSError):
+        return None
+    if not S_ISREG(fstat(fd).st_mode) or fcntl(fd, F_GETFL) & O_APPEND:
+        return None
+    return fd
+
+def section_size(header, n, width):
+    return len(header) + n + max(1, -(-n // width))
+
+def positional_writer(fd, offset):
+    from os import pwrite
+    def write(data):
+        nonlocal offset
+        data = memoryview(data)
+        while data:
+            written = pwrite(fd, data, offset)
+            offset += written
+            data = data[written:]
+    return write
+
+def write_at(fd, offset, target, args):
+    global write
+    write = positional_writer(fd, offset)
+    target(*args)
+
 @contextmanager
 def lock_pair(pre_lock=None, post_lock=None, locks=None):
     pre, post = locks if locks else (pre_lock, post_lock)
@@ -61,6 +96,24 @@ def write_lines(
         write(output)
     stdout.buffer.flush()
 
+def write_periodic(sequence, n, width, block_size=1 << 20, newline=b'\n'):
+    period = lcm(len(sequence), width)
+    repeated = sequence * (period // len(sequence))
+    lines = b''.join(repeated[i:i + width] + newline
+                     for i in range(0, period, width))
+    repeats = max(1, block_size // len(lines))
+    block = lines * repeats
+
+    for _ in range(n // (period * repeats)):
+        write(block)
+
+    rest = n % (period * repeats)
+    output = block[:rest + rest // width]
+    if rest % width or not n:
+        output += newline
+    write(output)
+    stdout.buffer.flush()
+
 def cumulative_probabilities(alphabet, factor=1.0):
     probabilities = tuple(accumulate(p * factor for _, p in alphabet))
 
@@ -71,14 +124,16 @@ def cumulative_probabilities(alphabet, factor=1.0):
 
     return probabilities, table
 
-def copy_from_sequence(header, sequence, n, width, locks=None):
-    sequence = bytearray(sequence, encoding='utf8')
-    while len(sequence) < n:
-        sequence.extend(sequence)
+def copy_from_sequence(
+        header, sequence, n, width, locks=None, positions=None):
+    if positions:
+        return [started_process(
+            write_at, positions + (copy_from_sequence,
+                                   (header, sequence, n, width)))]
 
     with lock_pair(locks=locks):
         write(header)
-        write_lines(sequence, n, width)
+        write_periodic(sequence.encode(), n, width)
 
 def lcg(seed, im, ia, ic):
     local_seed = seed.value
@@ -89,6 +144,16 @@ def lcg(seed, im, ia, ic):
     finally:
         seed.value = local_seed
 
+def lcg_jump(seed, steps, im, ia, ic):
+    im, ia, ic = int(im), int(ia), int(ic)
+    a, c = 1, 0
+    while steps:
+        if steps & 1:
+            a, c = a * ia % im, (c * ia + ic) % im
+        ia, ic = ia * ia % im, (ic * ia + ic) % im
+        steps >>= 1
+    return float((a * int(seed) + c) % im)
+
 def lookup(probabilities, values):
     for value in values:
         yield bisect(probabilities, value)
@@ -106,6 +171,19 @@ def lcg_lookup_fast(probabilities, seed, im, ia, ic):
     finally:
         seed.value = local_seed
 
+def lcg_symbols(probabilities, im):
+    return bytes(bisect(probabilities, state) for state in range(int(im)))
+
+def lcg_lookup_table(symbols, seed, im, ia, ic):
+    im, ia, ic = int(im), int(ia), int(ic)
+    local_seed = int(seed.value)
+    try:
+        while True:
+            local_seed = (local_seed * ia + ic) % im
+            yield symbols[local_seed]
+    finally:
+        seed.value = local_seed
+
 def lookup_and_write(
         header, probabilities, table, values, start, stop, width, locks=None):
     if isinstance(values, bytearray):
@@ -119,41 +197,75 @@ def lookup_and_write(
             write(header)
         write_lines(output, len(output), width, newline=b'\xff', table=table)
 
-def random_selection(header, alphabet, n, width, seed, locks=None):
+def jump_lookup_and_write(
+        header, symbols, table, seed, lcg_args, start, stop, width,
+        locks=None):
+    seed = RawValue('d', lcg_jump(seed, start, *lcg_args))
+    with closing(lcg_lookup_table(symbols, seed, *lcg_args)) as prng:
+        output = bytearray(islice(prng, stop - start))
+
+    lookup_and_write(header, None, table, output, start, stop, width, locks)
+
+def partition(n, width):
+    m = min(cpu_count() * 3, n // width) if n > width * 15 else 1
+    return [n // (width * m) * width * i for i in range(1, m)]
+
+def random_selection(
+        header, alphabet, n, width, seed, locks=None, positions=None):
     im = 139968.0
     ia = 3877.0
     ic = 29573.0
 
     probabilities, table = cumulative_probabilities(alphabet, im)
+    symbols = lcg_symbols(probabilities, im)
+
+    if positions:
+        fd, offset = positions
+
+        partitions = partition(n, width)
+
+        processes = []
+        for start, stop in zip([0] + partitions, partitions + [n]):
+            position = offset
+            if start:
+                position += len(header) + start + start // width
+            processes.append(started_process(
+                write_at,
+                (fd, position, jump_lookup_and_write,
+                 (header, symbols, table, seed.value, (im, ia, ic),
+                  start, stop, width))
+            ))
+
+        seed.value = lcg_jump(seed.value, n, im, ia, ic)
+        return processes
 
     if not locks:
-        with closing(lcg_lookup_fast(probabilities, seed, im, ia, ic)) as prng:
+        with closing(lcg_lookup_table(symbols, seed, im, ia, ic)) as prng:
             output = bytearray(islice(prng, n))
 
         lookup_and_write(header, probabilities, table, output, 0, n, width)
     else:
         pre_seed, post_seed, pre_write, post_write = locks
 
-        m = cpu_count() * 3 if n > width * 15 else 1
-        partitions = [n // (width * m) * width * i for i in range(1, m)]
+        partitions = partition(n, width)
 
         processes = []
         pre = pre_write
 
         with lock_pair(locks=(pre_seed, post_seed)):
-            with closing(lcg(seed, im, ia, ic)) as prng:
-                for start, stop in zip([0] + partitions, partitions + [n]):
-                    values = list(islice(prng, stop - start))
+            first_seed = seed.value
+            seed.value = lcg_jump(first_seed, n, im, ia, ic)
 
-                    post = acquired_lock() if stop < n else post_write
+        for start, stop in zip([0] + partitions, partitions + [n]):
+            post = acquired_lock() if stop < n else post_write
 
-                    processes.append(started_process(
-                        lookup_and_write,
-                        (header, probabilities, table, values,
-                         start, stop, width, (pre, post))
-                    ))
+            processes.append(started_process(
+                jump_lookup_and_write,
+                (header, symbols, table, first_seed, (im, ia, ic),
+                 start, stop, width, (pre, post))
+            ))
 
-                    pre = post
+            pre = post
 
         for p in processes:
             p.join()
@@ -184,9 +296,31 @@ CCACTGCACTCCAGCCTGGGCGACAGAGCGAGACTCCGTCTCAAAAA
          [b'>THREE Homo sapiens frequency\n', homosapiens, n * 5, width, seed]),
     ]
 
+    fd = positional_output()
+
     if cpu_count() < 2:
         for func, args in tasks:
             func(*args)
+    elif fd is not None:
+        start = offset = lseek(fd, 0, SEEK_CUR)
+        end = start + sum(section_size(args[0], args[2], width)
+                          for _, args in tasks)
+        stdout.buffer.flush()
+        try:
+            from os import posix_fallocate
+            posix_fallocate(fd, start, end - start)
+        except (ImportError, OSError):
+            pass
+
+        processes = []
+        for func, args in tasks:
+            processes += func(*args, positions=(fd, offset))
+            offset += section_size(args[0], args[2], width)
+
+        for p in processes:
+            p.join()
+
+        lseek(fd, end, SEEK_SET)
     else:
         written_1 = acquired_lock()
         seeded_2 = acquired_lock()
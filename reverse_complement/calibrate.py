@@ -0,0 +1,154 @@
+"""
+Find the optimal BLOCK_SIZE for reverse_complement.py on this host.
+
+The block sizes that are tried are derived from the cache sizes of the CPU.
+Each of them is timed on a generated FASTA file and the fastest one is stored
+in a profile that reverse_complement.py loads at startup.
+"""
+
+import argparse
+import glob
+import io
+import json
+import os
+import random
+import socket
+import sys
+import time
+from typing import Dict, List
+
+import reverse_complement
+from reverse_complement import (DEFAULT_BLOCK_SIZE, calibration_profile_path,
+                                parse_fasta, parse_size)
+
+
+def cache_topology() -> Dict[str, int]:
+    """
+    Read the data and unified caches from /sys/devices/system/cpu/*/cache.
+    Returns a dictionary such as {"L1d": 49152, "L2": 2097152}. Hybrid CPUs
+    have cores with different cache sizes, the smallest size is reported as
+    that is what a process that is scheduled anywhere can count on.
+    """
+    caches = {}
+    for index in glob.glob("/sys/devices/system/cpu/cpu[0-9]*/cache/index*"):
+        try:
+            with open(os.path.join(index, "type")) as type_file:
+                cache_type = type_file.read().strip()
+            with open(os.path.join(index, "level")) as level_file:
+                level = level_file.read().strip()
+            with open(os.path.join(index, "size")) as size_file:
+                size = parse_size(size_file.read().strip())
+        except (OSError, ValueError):
+            continue
+        if cache_type == "Instruction":
+            continue
+        name = f"L{level}d" if cache_type == "Data" else f"L{level}"
+        caches[name] = min(size, caches.get(name, size))
+    return caches
+
+
+def candidate_block_sizes(caches: Dict[str, int]) -> List[int]:
+    """
+    Powers of two from 8K up to twice the largest cache that is private to a
+    core. Beyond that a block and its reverse complement do not fit in cache.
+    """
+    largest = caches.get("L2", caches.get("L1d", DEFAULT_BLOCK_SIZE))
+    upper = max(2 * largest, 2 * DEFAULT_BLOCK_SIZE)
+    sizes = []
+    block_size = 8 * 1024
+    while block_size <= upper:
+        sizes.append(block_size)
+        block_size *= 2
+    return sizes
+
+
+def generate_fasta(size: int, seed: int = 42) -> bytes:
+    """
+    Generate a FASTA file with three records, totalling roughly size bases.
+    The records end in a partial line like those of the benchmark input.
+    """
+    rng = random.Random(seed)
+    to_bases = bytes(b"ACGT"[i % 4] for i in range(256))
+    records = []
+    for number, fraction in enumerate((0.2, 0.3, 0.5)):
+        sequence = rng.randbytes(int(size * fraction) + 20).translate(to_bases)
+        lines = [sequence[i:i + 60] for i in range(0, len(sequence), 60)]
+        records.append(b">record%d\n" % number + b"\n".join(lines) + b"\n")
+    return b"".join(records)
+
+
+class _NullWriter:
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def time_block_size(data: bytes, block_size: int, repeats: int
+                    ) -> Dict[str, float]:
+    """Best time out of repeats for parsing and for reverse complementing."""
+    parse_time = float("inf")
+    reverse_complement_time = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in parse_fasta(io.BytesIO(data), block_size):
+            pass
+        parse_time = min(parse_time, time.perf_counter() - start)
+        start = time.perf_counter()
+        reverse_complement.reverse_complement(
+            io.BytesIO(data), _NullWriter(), block_size=block_size)
+        reverse_complement_time = min(reverse_complement_time,
+                                      time.perf_counter() - start)
+    return {"parse_fasta": parse_time,
+            "reverse_complement": reverse_complement_time}
+
+
+def calibrate(size: int, repeats: int) -> dict:
+    caches = cache_topology()
+    data = generate_fasta(size)
+    timings = {}
+    for block_size in candidate_block_sizes(caches):
+        timings[block_size] = time_block_size(data, block_size, repeats)
+        print(f"{block_size:>10} "
+              f"{timings[block_size]['parse_fasta']:.4f}s "
+              f"{timings[block_size]['reverse_complement']:.4f}s",
+              file=sys.stderr)
+    best = min(timings, key=lambda size: timings[size]["reverse_complement"])
+    return {
+        "host": socket.gethostname(),
+        "block_size": best,
+        "caches": caches,
+        "bases": size,
+        "timings": {str(size): timing for size, timing in timings.items()},
+        "python": sys.version.split()[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=32,
+                        help="Size of the generated input in MiB. "
+                             "Default: 32.")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="Best of this many runs is used. Default: 3.")
+    parser.add_argument("--profile", default=calibration_profile_path(),
+                        help="Where to store the profile. Default: "
+                             "%(default)s.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Print the profile instead of storing it.")
+    args = parser.parse_args()
+    profile = calibrate(args.size * 1024 * 1024, args.repeats)
+    if args.dry_run:
+        json.dump(profile, sys.stdout, indent=2)
+        print()
+        return
+    os.makedirs(os.path.dirname(args.profile), exist_ok=True)
+    with open(args.profile, "wt") as profile_file:
+        json.dump(profile, profile_file, indent=2)
+    print(f"BLOCK_SIZE {profile['block_size']} stored in {args.profile}",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Reverse complement many FASTA files at once.
+
+The files are given on the command line or in a manifest and are spread over
+a pool of worker processes, the largest files first. Every input gets its own
+output, and the throughput of every file is reported as it is done.
+"""
+
+import argparse
+import collections
+import os
+import sys
+import time
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from reverse_complement import parse_size, reverse_complement
+
+
+class BatchResult(NamedTuple):
+    """The outcome of reverse complementing one file of a batch."""
+    input_path: str
+    output_path: str
+    size: int  # Bytes of input.
+    seconds: float
+    error: Optional[BaseException] = None
+
+
+def _reverse_complement_file(input_path: str, output_path: str,
+                             options: dict) -> float:
+    """
+    Reverse complement a file, returns the time it took. The output is only
+    put in place once it is complete, so a failure never leaves a partial
+    output behind or truncates an existing file.
+    """
+    started = time.perf_counter()
+    partial = output_path + ".partial"
+    try:
+        with open(input_path, "rb") as inp, open(partial, "wb") as outp:
+            reverse_complement(inp, outp, **options)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    os.replace(partial, output_path)
+    return time.perf_counter() - started
+
+
+def reverse_complement_files(jobs: Iterable[Tuple[str, str]],
+                             workers: Optional[int] = None,
+                             **options) -> Iterator[BatchResult]:
+    """
+    Reverse complement every input path of jobs into its output path on a
+    pool of worker processes, one file per worker. The largest files are
+    started first, so a large file does not start last while the other
+    workers are idle. Results are yielded as the files are done. A failing
+    file does not stop the others, its error is in the result instead.
+    options are passed to reverse_complement.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    sized = []
+    for input_path, output_path in jobs:
+        try:
+            sized.append((os.path.getsize(input_path), input_path,
+                          output_path))
+        except OSError as error:
+            yield BatchResult(input_path, output_path, 0, 0.0, error)
+    sized.sort(reverse=True)
+    if not sized:
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {}
+        for job in sized:
+            _, input_path, output_path = job
+            futures[pool.submit(_reverse_complement_file, input_path,
+                                output_path, options)] = job
+        for future in as_completed(futures):
+            size, input_path, output_path = futures[future]
+            try:
+                seconds = future.result()
+            except Exception as error:
+                yield BatchResult(input_path, output_path, size, 0.0, error)
+            else:
+                yield BatchResult(input_path, output_path, size, seconds)
+
+
+def output_path(input_path: str, directory: Optional[str],
+                compression: Optional[str]) -> str:
+    """
+    Name the output after the input, with .rc before the extension, such as
+    reads.rc.fa for reads.fa.gz. Without directory it is next to the input.
+    """
+    directory = directory or os.path.dirname(input_path)
+    name = os.path.basename(input_path)
+    if name.endswith(".gz"):
+        name = name[:-3]  # The output is only compressed on request.
+    stem, extension = os.path.splitext(name)
+    name = f"{stem}.rc{extension}"
+    if compression is not None:
+        name += ".gz"
+    return os.path.join(directory, name)
+
+
+def _file_id(path: str) -> Optional[Tuple[int, int]]:
+    """The device and inode of path, or None if it does not exist."""
+    try:
+        status = os.stat(path)
+    except OSError:
+        return None
+    return status.st_dev, status.st_ino
+
+
+def read_manifest(manifest: str) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    Read a manifest with an input path on every line, optionally followed by
+    a tab and its output path. Empty lines and lines starting with # are
+    skipped. '-' reads the manifest from stdin.
+    """
+    with (sys.stdin if manifest == "-" else open(manifest, "rt")) as lines:
+        for line in lines:
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            input_path, _, output = line.partition("\t")
+            yield input_path, output or None
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("inputs", nargs="*", metavar="INPUT",
+                        help="Input FASTA files.")
+    parser.add_argument("-f", "--manifest",
+                        help="File with an input path on every line, "
+                             "optionally followed by a tab and an output "
+                             "path. '-' for stdin.")
+    parser.add_argument("-o", "--output-dir",
+                        help="Directory for the outputs. Default: next to "
+                             "their input.")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                        help="Number of files that are done at once. "
+                             "Default: %(default)s.")
+    parser.add_argument("-b", "--block-size", type=int,
+                        help="Size of the blocks that are read and processed "
+                             "at once.")
+    parser.add_argument("-m", "--max-memory", type=parse_size,
+                        help="Sequences larger than this are spilled to a "
+                             "temporary file. Accepts K, M and G suffixes.")
+    parser.add_argument("-z", "--compression", choices=("bgzf", "gzip"),
+                        help="Compress the outputs.")
+    parser.add_argument("-q", "--fastq", action="store_true",
+                        help="The inputs are FASTQ rather than FASTA.")
+    args = parser.parse_args(argv)
+    jobs = [(input_path, None) for input_path in args.inputs]
+    if args.manifest:
+        jobs.extend(read_manifest(args.manifest))
+    if not jobs:
+        parser.error("no inputs given")
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    jobs = [(input_path,
+             output or output_path(input_path, args.output_dir,
+                                   args.compression))
+            for input_path, output in jobs]
+    outputs = collections.Counter(os.path.abspath(output)
+                                  for _, output in jobs)
+    duplicates = sorted(output for output, count in outputs.items()
+                        if count > 1)
+    if duplicates:
+        parser.error(f"more than one input is written to "
+                     f"{', '.join(duplicates)}")
+    # An output that is also an input would be overwritten while it is read,
+    # for instance when the outputs of a previous run are among the inputs.
+    inputs = {os.path.realpath(input_path) for input_path, _ in jobs}
+    input_ids = set(filter(None, map(_file_id, inputs)))
+    overwritten = sorted(output for _, output in jobs
+                         if os.path.realpath(output) in inputs or
+                         _file_id(output) in input_ids)
+    if overwritten:
+        parser.error(f"outputs would overwrite inputs: "
+                     f"{', '.join(overwritten)}")
+    total_size = 0
+    failures = 0
+    started = time.perf_counter()
+    for result in reverse_complement_files(
+            jobs, args.workers, block_size=args.block_size,
+            max_memory=args.max_memory, compression=args.compression,
+            fastq=args.fastq):
+        if result.error is not None:
+            failures += 1
+            print(f"FAILED {result.input_path}: {result.error!r}",
+                  file=sys.stderr)
+            continue
+        total_size += result.size
+        print(f"{result.size / max(result.seconds, 1e-9) / 10 ** 6:8.1f}MB/s "
+              f"{result.seconds:8.3f}s {result.input_path} -> "
+              f"{result.output_path}", file=sys.stderr)
+    seconds = time.perf_counter() - started
+    print(f"{len(jobs) - failures} files, {total_size / 10 ** 6:.1f}MB in "
+          f"{seconds:.3f}s, {total_size / seconds / 10 ** 6:.1f}MB/s, "
+          f"{failures} failed", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
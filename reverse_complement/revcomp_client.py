@@ -0,0 +1,79 @@
+"""
+Send a FASTA file to a running reverse_complement.py --serve and write the
+reverse complement to stdout. The client only imports what it needs to talk
+to the server, so it starts much faster than reverse_complement.py.
+"""
+
+import argparse
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+
+# See _FrameWriter in reverse_complement.py.
+_FRAME_HEADER = struct.Struct("<I")
+_ERROR_FRAME = 0xffffffff
+
+
+def _send(connection: socket.socket, options: dict, inp):
+    try:
+        connection.sendall(json.dumps(options).encode() + b"\n")
+        for block in iter(lambda: inp.read(256 * 1024), b""):
+            connection.sendall(block)
+        connection.shutdown(socket.SHUT_WR)
+    except OSError:  # The server stopped reading, it reports why.
+        pass
+
+
+def reverse_complement(path: str, inp, outp, **options):
+    """
+    Let the server at path reverse complement inp into outp. Input is sent on
+    a separate thread, so the server never waits for output to be read while
+    the client is still sending input. Raises RuntimeError for errors of the
+    server.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        sender = threading.Thread(target=_send,
+                                  args=(connection, options, inp),
+                                  daemon=True)
+        sender.start()
+        with connection.makefile("rb") as frames:
+            while True:
+                header = frames.read(_FRAME_HEADER.size)
+                if len(header) != _FRAME_HEADER.size:
+                    raise RuntimeError("connection closed by the server")
+                size, = _FRAME_HEADER.unpack(header)
+                if size == 0:
+                    break
+                if size == _ERROR_FRAME:
+                    raise RuntimeError(frames.read().decode())
+                outp.write(frames.read(size))
+        sender.join()
+    outp.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-s", "--socket",
+                        default=os.environ.get("REVCOMP_SOCKET"),
+                        help="Socket of the server. Default: "
+                             "$REVCOMP_SOCKET.")
+    parser.add_argument("-q", "--fastq", action="store_true",
+                        help="The input is FASTQ rather than FASTA.")
+    parser.add_argument("-z", "--compression", choices=("bgzf", "gzip"),
+                        help="Compress the output.")
+    args = parser.parse_args()
+    if not args.socket:
+        parser.error("no socket given and REVCOMP_SOCKET is not set")
+    try:
+        reverse_complement(args.socket, sys.stdin.buffer, sys.stdout.buffer,
+                           fastq=args.fastq, compression=args.compression)
+    except RuntimeError as error:
+        sys.exit(f"revcomp server: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,31 +9,467 @@ with all the sequences reverse complemented.
 """
 # The rationale for this program is described in a comment below.
 
+import argparse
+import collections
+import io
+import json
+import mmap
+import os
+import socket
+import stat
+import struct
 import sys
-from typing import BinaryIO, Iterator, List, Tuple
+import time
+from typing import (BinaryIO, Callable, Dict, Iterable, Iterator, List,
+                    NamedTuple, Optional, Tuple, Union)
 
 # BLOCK_SIZE: larger means less blocks and therefore less Python overhead.
 # smaller means less cache misses. There is a tradeoff.
 # The optimal setting on my test machine is:
-BLOCK_SIZE = 32 * 1024
+DEFAULT_BLOCK_SIZE = 32 * 1024
 
 
-def parse_fasta(inp: BinaryIO) -> Iterator[Tuple[bytes, List[bytes]]]:
-    block_size = BLOCK_SIZE
+def calibration_profile_path() -> str:
+    """The location of the profile for this host written by calibrate.py."""
+    cache_dir = (os.environ.get("XDG_CACHE_HOME") or
+                 os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_dir, "revcomp", f"{socket.gethostname()}.json")
+
+
+_SIZE_SUFFIXES = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(size: str) -> int:
+    """Parse a size in bytes with an optional suffix, such as '48K' or '2G'."""
+    suffix = size[-1:].upper()
+    if suffix in _SIZE_SUFFIXES:
+        return int(size[:-1]) * _SIZE_SUFFIXES[suffix]
+    return int(size)
+
+
+def _configured_block_size() -> int:
+    """
+    The optimal setting depends on the cache sizes of the machine. Use the
+    block size that calibrate.py measured on this host, unless it is
+    overridden with the REVCOMP_BLOCK_SIZE environment variable, such as 64K.
+    An invalid override or profile is ignored.
+    """
+    try:
+        override = parse_size(os.environ.get("REVCOMP_BLOCK_SIZE", ""))
+    except ValueError:
+        override = 0
+    if override > 0:
+        return override
+    try:
+        with open(calibration_profile_path(), "rb") as profile:
+            calibrated = int(json.load(profile)["block_size"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return DEFAULT_BLOCK_SIZE
+    return calibrated if calibrated > 0 else DEFAULT_BLOCK_SIZE
+
+
+BLOCK_SIZE = _configured_block_size()
+
+# BATCH_SIZE: the minimum amount of sequence that is sent to a worker process
+# at once. Many small records are grouped so the overhead of setting up shared
+# memory is paid only once per batch.
+BATCH_SIZE = 1024 * 1024
+
+LINE_LENGTH = 60
+
+# Sequences that span at least this many lines are formatted column by column
+# instead of line by line. See _format_lines.
+_COLUMN_FORMAT_LINES = 512
+
+_LETTERS = b"ACGTUMRYKVHDB"
+_COMPLMN = b"TGCAAKYRMBDHV"
+TRANSLATE_TABLE = bytes.maketrans(
+    _LETTERS + _LETTERS.lower(),
+    _COMPLMN + _COMPLMN,
+)
+
+# Pages of a memory mapped input are returned to the OS as soon as they have
+# been processed. Not every platform supports this.
+_MADV_DONTNEED = getattr(mmap, "MADV_DONTNEED", None)
+
+
+class Stats:
+    """
+    Cumulative time and bytes for every stage of reverse complementing. The
+    read and write stages time the calls to the input and output, parse the
+    time spent finding records apart from reading. The translate, reverse
+    and format stages are timed for every block. Worker processes are not
+    included. Worker threads are, but without a GIL their updates can race.
+    """
+    STAGES = ("read", "parse", "translate", "reverse", "format", "write")
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(self.STAGES, 0.0)
+        self.bytes = dict.fromkeys(self.STAGES, 0)
+
+    def add(self, stage: str, started: float, size: int) -> float:
+        """Add the time since started to stage. Returns the current time."""
+        now = time.perf_counter()
+        self.seconds[stage] += now - started
+        self.bytes[stage] += size
+        return now
+
+    def records(self, records: Iterable[Tuple[bytes, Iterable[bytes]]]
+                ) -> Iterator[Tuple[bytes, Iterable[bytes]]]:
+        """Time the parsing of records, without the reads it does."""
+        records = iter(records)
+        while True:
+            started = time.perf_counter()
+            read_seconds = self.seconds["read"]
+            try:
+                record = next(records)
+            except StopIteration:
+                return
+            # Reads have been timed already.
+            self.add("parse", started + self.seconds["read"] - read_seconds,
+                     0)
+            yield record
+
+    def parts(self, parts: Iterator[bytes]) -> Iterator[bytes]:
+        """Time reading the parts of memory mapped or spilled sequences."""
+        while True:
+            started = time.perf_counter()
+            try:
+                part = next(parts)
+            except StopIteration:
+                return
+            self.add("read", started, len(part))
+            yield part
+
+    def report(self) -> dict:
+        return {stage: {"seconds": self.seconds[stage],
+                        "bytes": self.bytes[stage]}
+                for stage in self.STAGES}
+
+    def write_report(self, destination: str):
+        """Write the report as JSON to a file, or stderr for '-'."""
+        if destination == "-":
+            json.dump(self.report(), sys.stderr, indent=2)
+            print(file=sys.stderr)
+        else:
+            with open(destination, "wt") as report_file:
+                json.dump(self.report(), report_file, indent=2)
+
+
+class _TimedReader:
+    """Times the reads of a file object, everything else is passed on."""
+    def __init__(self, raw: BinaryIO, stats: Stats):
+        self.raw = raw
+        self.stats = stats
+
+    def read(self, size: int = -1) -> bytes:
+        started = time.perf_counter()
+        block = self.raw.read(size)
+        self.stats.add("read", started, len(block))
+        return block
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+class _TimedWriter:
+    """Times the writes of a file object, everything else is passed on."""
+    def __init__(self, raw: BinaryIO, stats: Stats):
+        self.raw = raw
+        self.stats = stats
+
+    def write(self, data: bytes):
+        started = time.perf_counter()
+        self.raw.write(data)
+        self.stats.add("write", started, len(data))
+
+    def flush(self):
+        started = time.perf_counter()
+        self.raw.flush()
+        self.stats.add("write", started, 0)
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+# Instrumentation is off unless REVCOMP_STATS is set, to a file for the
+# report or to '-' for stderr. See Stats.
+STATS = Stats() if os.environ.get("REVCOMP_STATS") else None
+
+
+# Blocks that a reader thread may have waiting for the main thread at once.
+READ_AHEAD = 4
+# Batches of output that may be waiting for a writer thread at once.
+WRITE_BEHIND = 4
+
+
+class _ThreadedReader:
+    """
+    A minimal file object that produces blocks on a separate thread. The
+    thread runs at most READ_AHEAD blocks ahead of the reads. Each read
+    returns the next block, which may be shorter than the requested size.
+    """
+    def __init__(self, blocks: Iterator[bytes]):
+        import queue
+        import threading
+        self._blocks = blocks
+        self._queue = queue.Queue(READ_AHEAD)
+        self._stopped = threading.Event()
+        self._done = False
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def _produce(self):
+        try:
+            for block in self._blocks:
+                self._queue.put(block)
+                if self._stopped.is_set():
+                    return
+            self._queue.put(b"")
+        except BaseException as error:  # Raised again in the main thread.
+            self._queue.put(error)
+
+    def read(self, size: int = -1) -> bytes:
+        if self._done:
+            return b""
+        block = self._queue.get()
+        if isinstance(block, BaseException):
+            self._done = True
+            raise block
+        if block == b"":
+            self._done = True
+        return block
+
+    def close(self):
+        self._stopped.set()
+        while self._thread.is_alive():
+            # Make room for a block the thread may be waiting to put.
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._thread.join(0.01)
+
+
+class _PrefixedReader:
+    """A minimal file object that returns prefix before the rest of inp."""
+    def __init__(self, prefix: bytes, inp: BinaryIO):
+        self.prefix = prefix
+        self.inp = inp
+
+    def read(self, size: int = -1) -> bytes:
+        if self.prefix:
+            prefix, self.prefix = self.prefix, b""
+            return prefix
+        return self.inp.read(size)
+
+
+def _read_blocks(inp: BinaryIO, block_size: int) -> Iterator[bytes]:
+    while True:
+        block = inp.read(block_size)
+        if not block:
+            return
+        yield block
+
+
+class _ThreadedWriter:
+    """
+    A minimal file object that writes on a separate thread. Writes are
+    gathered into batches of at least batch_size which are handed to the
+    thread, at most WRITE_BEHIND of them can be waiting. Errors of the thread
+    are raised by the next write or flush.
+    """
+    def __init__(self, raw: BinaryIO, batch_size: int):
+        import queue
+        import threading
+        self.raw = raw
+        self.batch_size = batch_size
+        self._batch = []
+        self._batch_bytes = 0
+        self._queue = queue.Queue(WRITE_BEHIND)
+        self._error = None
+        self._thread = threading.Thread(target=self._consume, daemon=True)
+        self._thread.start()
+
+    def _consume(self):
+        while True:
+            batch = self._queue.get()
+            try:
+                if batch is None:
+                    return
+                if self._error is None:
+                    self.raw.write(b"".join(batch))
+            except BaseException as error:  # Raised again in the main thread.
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _check(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def write(self, data: bytes) -> int:
+        # Memoryviews may point into buffers that are reused or released
+        # before the thread gets to them.
+        self._batch.append(data if type(data) is bytes else bytes(data))
+        self._batch_bytes += len(data)
+        if self._batch_bytes >= self.batch_size:
+            self._check()
+            self._queue.put(self._batch)
+            self._batch = []
+            self._batch_bytes = 0
+        return len(data)
+
+    def flush(self):
+        """Wait until everything is written and flush the underlying file."""
+        if self._batch:
+            self._queue.put(self._batch)
+            self._batch = []
+            self._batch_bytes = 0
+        self._queue.join()
+        self._check()
+        self.raw.flush()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            if exc_info[0] is None:
+                self.flush()
+        finally:
+            self.close()
+
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZLIB_MAGIC = b"\x78"
+
+
+def _is_compressed(inp: BinaryIO) -> bool:
+    """Check for a gzip or zlib header without consuming it."""
+    if hasattr(inp, "peek"):
+        start = inp.peek(2)[:2]
+    elif hasattr(inp, "seekable") and inp.seekable():
+        position = inp.tell()
+        start = inp.read(2)
+        inp.seek(position)
+    else:
+        return False
+    # The two bytes of a zlib header are a multiple of 31, which makes an
+    # input that merely starts with "x" very unlikely to pass as one.
+    return start == _GZIP_MAGIC or (
+        start[:1] == _ZLIB_MAGIC and len(start) == 2 and
+        int.from_bytes(start, "big") % 31 == 0)
+
+
+def _inflate(inp: BinaryIO, block_size: int) -> Iterator[bytes]:
+    """
+    Decompress gzip or zlib data in blocks of at most block_size. Files with
+    multiple gzip members, such as those written by bgzip, are supported.
+    """
+    import zlib
+    # 32 + MAX_WBITS detects both the gzip and the zlib header.
+    wbits = 32 + zlib.MAX_WBITS
+    decompressor = zlib.decompressobj(wbits)
+    in_member = False
+    data = b""
+    while True:
+        if not data:
+            data = inp.read(block_size)
+            if not data:
+                break
+        block = decompressor.decompress(data, block_size)
+        in_member = True
+        if decompressor.eof:  # The next member starts in unused_data.
+            data = decompressor.unused_data
+            decompressor = zlib.decompressobj(wbits)
+            in_member = False
+        else:
+            data = decompressor.unconsumed_tail
+        if block:
+            yield block
+    block = decompressor.flush()
+    if block:
+        yield block
+    if in_member and not decompressor.eof:
+        raise EOFError("compressed input ended before the end-of-stream "
+                       "marker was reached")
+
+
+class _SpilledSequence:
+    """
+    A sequence that exceeded the memory budget of parse_fasta. Its parts are
+    appended to a temporary file and read back in BLOCK_SIZE segments, in
+    reverse when iterating over it in reverse.
+    """
+    def __init__(self, parts: List[bytes], block_size: int):
+        import tempfile  # Only needed for very large sequences.
+        self.file = tempfile.TemporaryFile(buffering=0)
+        self.block_size = block_size
+        self.size = 0
+        for part in parts:
+            self.append(part)
+
+    def append(self, part: bytes):
+        self.file.write(part)
+        self.size += len(part)
+
+    def _read(self, start: int, end: int) -> bytes:
+        self.file.seek(start)
+        return self.file.read(end - start)
+
+    def __iter__(self) -> Iterator[bytes]:
+        for start in range(0, self.size, self.block_size):
+            yield self._read(start, min(start + self.block_size, self.size))
+
+    def __reversed__(self) -> Iterator[bytes]:
+        for end in range(self.size, 0, -self.block_size):
+            yield self._read(max(end - self.block_size, 0), end)
+
+    def __del__(self):
+        self.file.close()
+
+
+def parse_fasta(inp: BinaryIO, block_size: Optional[int] = None,
+                max_memory: Optional[int] = None
+                ) -> Iterator[Tuple[bytes, List[bytes]]]:
+    """
+    Parse FASTA from a stream. The parts of a sequence are kept in memory
+    until the next sequence starts. When they exceed max_memory bytes they
+    are spilled to a temporary file instead. Gzip or zlib compressed input is
+    decompressed on a separate thread.
+    """
+    block_size = block_size or BLOCK_SIZE
+    if _is_compressed(inp):
+        reader = _ThreadedReader(_inflate(inp, block_size))
+        try:
+            yield from parse_fasta(reader, block_size, max_memory)
+        finally:
+            reader.close()
+        return
     name_index = 0
     block = inp.read(block_size)
     while True:
         name_end = block.find(b"\n", name_index)
         if name_end == -1:  # name runs past the end of block
-            name_part = block[name_index:]
-            block = inp.read(block_size)
-            if block == b"":
-                raise EOFError("truncated FASTA file")
-            name_end = block.find(b"\n", name_index)
-            name = name_part + block[:name_end]
+            name = block[name_index:]
+            while True:
+                block = inp.read(block_size)
+                if block == b"":
+                    raise EOFError("truncated FASTA file")
+                name_end = block.find(b"\n")
+                if name_end != -1:
+                    break
+                name += block
+            name += block[:name_end]
         else:
             name = block[name_index: name_end]
         seq_parts = []
+        seq_size = 0
         while True:  # gather all blocks until the next sequence
             name_index = block.find(b">", name_end)
             if name_index != -1:
@@ -41,6 +477,10 @@ def parse_fasta(inp: BinaryIO) -> Iterator[Tuple[bytes, List[bytes]]]:
                 yield name, seq_parts
                 break
             seq_parts.append(block[name_end:])
+            if max_memory is not None and isinstance(seq_parts, list):
+                seq_size += len(block) - name_end
+                if seq_size > max_memory:
+                    seq_parts = _SpilledSequence(seq_parts, block_size)
             block = inp.read(block_size)
             if block == b"":
                 yield name, seq_parts
@@ -48,41 +488,1380 @@ def parse_fasta(inp: BinaryIO) -> Iterator[Tuple[bytes, List[bytes]]]:
             name_end = 0
 
 
-def reverse_complement(inp: BinaryIO, outp: BinaryIO):
-    letters = b"ACGTUMRYKVHDB"
-    complmn = b"TGCAAKYRMBDHV"
-    translate_table = bytes.maketrans(
-        letters + letters.lower(),
-        complmn + complmn,
-    )
-    line_length = 60
-    for name, sequence_parts in parse_fasta(inp):
+def _fastq_blocks(inp: BinaryIO, block_size: int) -> Iterator[List[bytes]]:
+    """
+    Read FASTQ in blocks and yield the lines of the whole records in each
+    block, four lines per record. Lines of the last, incomplete record are
+    carried over to the next block.
+    """
+    rest = b""
+    while True:
+        block = inp.read(block_size)
+        if not block:
+            break
+        lines = (rest + block).split(b"\n")
+        # The last line is not terminated yet.
+        end = len(lines) - 1 - (len(lines) - 1) % 4
+        rest = b"\n".join(lines[end:])
+        del lines[end:]
+        if lines:
+            _check_fastq(lines)
+            yield lines
+    rest = rest.rstrip(b"\n")
+    if rest:
+        lines = rest.split(b"\n")
+        if len(lines) % 4:
+            raise EOFError("truncated FASTQ file")
+        _check_fastq(lines)
+        yield lines
+
+
+def _check_fastq(lines: List[bytes]):
+    """Check that lines hold FASTQ records without looping over them."""
+    names = lines[0::4]
+    separators = lines[2::4]
+    if (not names[0].startswith(b"@") or not separators[0].startswith(b"+")
+            or b"\n".join(names).count(b"\n@") != len(names) - 1 or
+            b"\n".join(separators).count(b"\n+") != len(separators) - 1):
+        raise ValueError("malformed FASTQ record, only records of four "
+                         "lines are supported")
+    if list(map(len, lines[1::4])) != list(map(len, lines[3::4])):
+        raise ValueError("FASTQ sequence and quality lengths differ")
+
+
+def parse_fastq(inp: BinaryIO, block_size: Optional[int] = None
+                ) -> Iterator[Tuple[bytes, bytes, bytes]]:
+    """
+    Parse FASTQ records of four lines into name, sequence and quality. The
+    name includes the @, the line with the + is skipped.
+    """
+    block_size = block_size or BLOCK_SIZE
+    for lines in _fastq_blocks(inp, block_size):
+        yield from zip(lines[0::4], lines[1::4], lines[3::4])
+
+
+def _reverse_complement_fastq(inp: BinaryIO, outp: BinaryIO,
+                              block_size: int):
+    """
+    Reverse complement the sequences and reverse the qualities of all FASTQ
+    records. Like for short FASTA records, the lines of a whole block are
+    joined, translated and reversed at once.
+    """
+    translate_table = TRANSLATE_TABLE
+    stats = STATS
+    for lines in _fastq_blocks(inp, block_size):
+        if stats is not None:
+            started = time.perf_counter()
+        sequences = b"\n".join(lines[1::4]).translate(translate_table)
+        size = len(sequences)
+        if stats is not None:
+            started = stats.add("translate", started, size)
+        sequences = sequences[::-1].split(b"\n")
+        sequences.reverse()
+        lines[1::4] = sequences
+        qualities = b"\n".join(lines[3::4])[::-1].split(b"\n")
+        qualities.reverse()
+        lines[3::4] = qualities
+        if stats is not None:
+            # The qualities are as long as the sequences.
+            started = stats.add("reverse", started, 2 * size)
+        lines.append(b"")  # Terminate the last record.
+        block = b"\n".join(lines)
+        if stats is not None:
+            stats.add("format", started, len(block))
+        outp.write(block)
+
+
+class _MappedSequence:
+    """
+    A sequence inside a memory mapped FASTA file or another buffer. Iterating
+    over it in reverse yields BLOCK_SIZE parts from the end of the sequence to
+    its start. Only the part currently being processed is copied out of the
+    buffer.
+    """
+    def __init__(self, mapped: Union[mmap.mmap, memoryview], start: int,
+                 end: int, block_size: int):
+        self.mapped = mapped
+        self.start = start
+        self.end = end
+        self.size = end - start
+        self.block_size = block_size
+
+    def __iter__(self) -> Iterator[bytes]:
+        mapped = self.mapped
+        release = isinstance(mapped, mmap.mmap)
+        for start in range(self.start, self.end, self.block_size):
+            end = min(start + self.block_size, self.end)
+            yield bytes(mapped[start:end])
+            if release:
+                _release_pages(mapped, self.start, end)
+
+    def __reversed__(self) -> Iterator[bytes]:
+        mapped = self.mapped
+        block_size = self.block_size
+        release = isinstance(mapped, mmap.mmap)
+        for end in range(self.end, self.start, -block_size):
+            start = max(end - block_size, self.start)
+            # Slicing a mmap gives bytes already, those are not copied again.
+            yield bytes(mapped[start:end])
+            if release:
+                _release_pages(mapped, start, self.end)
+
+
+def _release_pages(mapped: mmap.mmap, start: int, end: int):
+    """
+    Drop the pages between start and end from the resident memory. The kernel
+    maps in neighbouring pages on a page fault, so callers release everything
+    they have processed so far rather than just the last block.
+    """
+    if _MADV_DONTNEED is not None:
+        page_start = start - start % mmap.PAGESIZE
+        mapped.madvise(_MADV_DONTNEED, page_start, end - page_start)
+
+
+def _find_name(mapped: mmap.mmap, start: int) -> int:
+    """
+    Find the next '>' in the map. The scanned pages are released in windows
+    so searching a huge sequence does not make it resident all at once.
+    """
+    window = 32 * BLOCK_SIZE
+    size = len(mapped)
+    scan_start = start
+    while start < size:
+        index = mapped.find(b">", start, start + window)
+        if index != -1:
+            return index
+        start += window
+        _release_pages(mapped, scan_start, min(start, size))
+    return -1
+
+
+def parse_mapped_fasta(mapped: mmap.mmap, start: int = 0,
+                       block_size: Optional[int] = None
+                       ) -> Iterator[Tuple[bytes, _MappedSequence]]:
+    """
+    Parse a memory mapped FASTA file. Rather than copying the sequences this
+    yields lazy sequences which can be walked backwards block by block.
+    """
+    block_size = block_size or BLOCK_SIZE
+    name_index = start
+    while name_index != -1:
+        name_end = mapped.find(b"\n", name_index)
+        if name_end == -1:
+            raise EOFError("truncated FASTA file")
+        next_name_index = _find_name(mapped, name_end)
+        sequence_end = len(mapped) if next_name_index == -1 else next_name_index
+        yield (mapped[name_index:name_end],
+               _MappedSequence(mapped, name_end, sequence_end, block_size))
+        name_index = next_name_index
+
+
+# File objects whose file descriptor holds exactly the bytes they read. Others
+# with a fileno, such as gzip.open(), decode what is behind it.
+_FILE_READERS = (io.FileIO, io.BufferedReader, io.BufferedRandom)
+
+
+def _is_mappable(inp: BinaryIO) -> bool:
+    """Whether inp is a regular file that is not empty."""
+    if isinstance(inp, _TimedReader):
+        inp = inp.raw
+    if type(inp) not in _FILE_READERS:
+        return False
+    try:
+        fileno = inp.fileno()
+    except (AttributeError, OSError):  # io.UnsupportedOperation is an OSError
+        return False
+    file_stat = os.fstat(fileno)
+    return stat.S_ISREG(file_stat.st_mode) and file_stat.st_size > 0
+
+
+def _map_input(inp: BinaryIO) -> Optional[mmap.mmap]:
+    """Return a read-only memory map of inp if it is a regular file."""
+    if not _is_mappable(inp):
+        return None
+    return mmap.mmap(inp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class FaiEntry(NamedTuple):
+    """A line of a samtools compatible FASTA index (.fai)."""
+    name: str
+    length: int  # Number of bases.
+    offset: int  # Byte offset of the first base.
+    line_bases: int
+    line_width: int  # Bytes per line, including the newline.
+
+    def byte_offset(self, position: int) -> int:
+        """The byte offset of the base at a 0-based position."""
+        line, column = divmod(position, self.line_bases)
+        return self.offset + line * self.line_width + column
+
+
+def build_fasta_index(mapped: mmap.mmap) -> List[FaiEntry]:
+    """
+    Index a memory mapped FASTA file. Like samtools, every line of a sequence
+    but the last must have the same length, otherwise ValueError is raised.
+    """
+    entries = []
+    for header, sequence in parse_mapped_fasta(mapped):
+        name = header[1:].split(maxsplit=1)[0].decode() if header[1:] else ""
+        start = sequence.start + 1  # Skip the newline that ends the header.
+        end = sequence.end
+        first_end = mapped.find(b"\n", start, end)
+        if first_end == -1:  # A single line at the end of the file.
+            first_end = end
+        line_bases = first_end - start
+        line_width = line_bases + 1
+        if line_bases == 0:
+            entries.append(FaiEntry(name, 0, start, 0, 0))
+            continue
+        # Where the lines are of equal length, every line_width-th byte is a
+        # newline. Only the last line may be shorter.
+        line_ends = mapped[first_end:end:line_width]
+        if line_ends.count(b"\n") != len(line_ends):
+            raise ValueError(f"different line length in sequence '{name}'")
+        last_line = mapped[start + len(line_ends) * line_width:end]
+        last_line = last_line.rstrip(b"\n")
+        if b"\n" in last_line:
+            raise ValueError(f"different line length in sequence '{name}'")
+        length = len(line_ends) * line_bases + len(last_line)
+        entries.append(FaiEntry(name, length, start, line_bases, line_width))
+    return entries
+
+
+def load_fasta_index(path: str, index_path: Optional[str] = None
+                     ) -> Dict[str, FaiEntry]:
+    """
+    Read the .fai index of a FASTA file. The index is built and stored when
+    it does not exist yet or is older than the FASTA file.
+    """
+    index_path = index_path or path + ".fai"
+    try:
+        if os.path.getmtime(index_path) >= os.path.getmtime(path):
+            with open(index_path, "rt") as index_file:
+                entries = [FaiEntry(name, *map(int, fields))
+                           for name, *fields in
+                           (line.rstrip("\n").split("\t")
+                            for line in index_file)]
+            return {entry.name: entry for entry in entries}
+    except OSError:
+        pass
+    with open(path, "rb") as inp:
+        mapped = _map_input(inp)
+        if mapped is None:
+            raise ValueError(f"cannot index {path}: not a non-empty file")
+        with mapped:
+            entries = build_fasta_index(mapped)
+    try:
+        with open(index_path, "wt") as index_file:
+            for entry in entries:
+                index_file.write("\t".join(map(str, entry)) + "\n")
+    except OSError:  # Read-only directories still work, just slower.
+        pass
+    return {entry.name: entry for entry in entries}
+
+
+def parse_region(region: str, index: Dict[str, FaiEntry]
+                 ) -> Tuple[FaiEntry, int, int]:
+    """
+    Parse a samtools style region: 'name', 'name:start' or 'name:start-end'.
+    Positions are 1-based and inclusive. Returns the entry and the 0-based,
+    half-open range of positions.
+    """
+    if region in index:  # Names may contain colons themselves.
+        entry = index[region]
+        return entry, 0, entry.length
+    name, _, positions = region.rpartition(":")
+    if name not in index:
+        raise KeyError(f"sequence '{name or region}' not in index")
+    entry = index[name]
+    start, _, end = positions.replace(",", "").partition("-")
+    start = int(start)
+    end = min(int(end), entry.length) if end else entry.length
+    if start < 1 or start > end + 1:
+        raise ValueError(f"invalid region: {region}")
+    return entry, start - 1, end
+
+
+def reverse_complement_regions(path: str, regions: Iterable[str],
+                               outp: BinaryIO,
+                               block_size: Optional[int] = None,
+                               index_path: Optional[str] = None):
+    """
+    Reverse complement records or regions of an indexed FASTA file. Only the
+    bytes of those regions are read. Like samtools faidx -i, the sequences
+    are named after the region with /rc appended.
+    """
+    block_size = block_size or BLOCK_SIZE
+    index = load_fasta_index(path, index_path)
+    with open(path, "rb") as inp, \
+            mmap.mmap(inp.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for region in regions:
+            entry, start, end = parse_region(region, index)
+            outp.write(b">%s/rc\n" % region.encode())
+            if start == end:
+                continue
+            sequence = _MappedSequence(mapped, entry.byte_offset(start),
+                                       entry.byte_offset(end - 1) + 1,
+                                       block_size)
+            if _write_sequence(reversed(sequence), outp.write):
+                outp.write(b"\n")
+    outp.flush()
+
+
+def reverse_complement_in_place(path: str, block_size: Optional[int] = None):
+    """
+    Reverse complement every record of a FASTA file in the file itself,
+    through a writable memory map. Blocks of bases from the start and the
+    end of a record are complemented, reversed and swapped, keeping the
+    newlines where they are. The lines therefore keep the width they have in
+    the input. All lines of a record but the last must have the same width,
+    otherwise ValueError is raised before anything is changed.
+    """
+    block_size = block_size or BLOCK_SIZE
+    with open(path, "rb") as inp:
+        mapped = _map_input(inp)
+        if mapped is None:
+            raise ValueError(f"cannot reverse complement {path} in place: "
+                             f"not a non-empty file")
+        with mapped:
+            entries = build_fasta_index(mapped)
+    translate_table = TRANSLATE_TABLE
+    with open(path, "r+b") as inp, mmap.mmap(inp.fileno(), 0) as mapped:
+        for entry in entries:
+            line_bases = entry.line_bases
+            length = entry.length
+            front = 0  # Bases at either end that have been swapped.
+            while True:
+                size = min(block_size, (length - 2 * front) // 2)
+                if size == 0:
+                    break
+                front_start = entry.byte_offset(front)
+                front_end = entry.byte_offset(front + size - 1) + 1
+                back_start = entry.byte_offset(length - front - size)
+                back_end = entry.byte_offset(length - front - 1) + 1
+                front_bases = mapped[front_start:front_end].translate(
+                    translate_table, b"\n")[::-1]
+                back_bases = mapped[back_start:back_end].translate(
+                    translate_table, b"\n")[::-1]
+                mapped[front_start:front_end] = _format_lines(
+                    back_bases, front % line_bases, line_bases)
+                mapped[back_start:back_end] = _format_lines(
+                    front_bases, (length - front - size) % line_bases,
+                    line_bases)
+                front += size
+            if length % 2:  # The base in the middle stays where it is.
+                middle = entry.byte_offset(length // 2)
+                mapped[middle] = translate_table[mapped[middle]]
+        mapped.flush()
+
+
+def _format_lines(sequence: bytes, column: int,
+                  line_length: int = LINE_LENGTH) -> bytes:
+    """
+    Split the sequence into lines of line_length, starting on a line that
+    already holds column bases. The last line is not terminated.
+    """
+    size = len(sequence)
+    first = line_length - column  # Bases that go on the current line.
+    newlines = (column + size - 1) // line_length
+    if newlines < _COLUMN_FORMAT_LINES:
+        fasta_lines = [sequence[:first]]
+        fasta_lines += [sequence[i:i + line_length]
+                        for i in range(first, size, line_length)]
+        return b"\n".join(fasta_lines)
+    # Rather than slicing every line, every column of the output is copied in
+    # one go using extended slices. All bases at the same index on their line
+    # are LINE_LENGTH apart in the sequence and LINE_LENGTH + 1 apart in the
+    # output. Bases after the first line are shifted by its newline.
+    formatted = bytearray(size + newlines)
+    stride = line_length + 1
+    for index in range(first):
+        formatted[index::stride] = sequence[index::line_length]
+    for index in range(first, line_length):
+        formatted[index + 1::stride] = sequence[index::line_length]
+    formatted[first::stride] = b"\n" * newlines
+    return formatted
+
+
+# Sequences of at least NUMPY_SIZE bytes are formatted with NumPy when it is
+# installed. Importing it takes longer than formatting smaller sequences.
+NUMPY_SIZE = 16 * 1024 * 1024
+# The numpy module once it has been imported, False if it is not installed.
+_numpy = None
+
+
+def _format_lines_numpy(sequence: bytes, column: int):
+    """
+    Like _format_lines, but the lines after the first are copied into a
+    preallocated array of LINE_LENGTH + 1 columns, of which the first holds
+    the newline that ends the line before. NumPy is only imported on the
+    first call, without it _format_lines is used.
+    """
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy as _numpy
+        except ImportError:
+            _numpy = False
+    if _numpy is False:
+        return _format_lines(sequence, column)
+    line_length = LINE_LENGTH
+    bases = _numpy.frombuffer(sequence, dtype=_numpy.uint8)
+    size = len(bases)
+    first = min(line_length - column, size)  # Bases on the current line.
+    full_lines, last_line = divmod(size - first, line_length)
+    formatted = _numpy.empty(size + full_lines + (last_line > 0),
+                             dtype=_numpy.uint8)
+    formatted[:first] = bases[:first]
+    end = first + full_lines * (line_length + 1)
+    lines = formatted[first:end].reshape(full_lines, line_length + 1)
+    lines[:, 0] = ord("\n")
+    lines[:, 1:] = bases[first:size - last_line].reshape(full_lines,
+                                                          line_length)
+    if last_line:
+        formatted[end] = ord("\n")
+        formatted[end + 1:] = bases[size - last_line:]
+    return formatted
+
+
+def _write_sequence(reversed_parts: Iterable[bytes],
+                    write: Callable[[bytes], object],
+                    last_line_length: int = 0,
+                    format_lines: Callable = _format_lines) -> int:
+    """
+    Complement, reverse and format the parts of a sequence. The output
+    continues a line of last_line_length. Returns the length of the last line,
+    which is not terminated.
+
+    When the input already has lines of LINE_LENGTH, reversing a part leaves
+    its newlines exactly where the output needs them. Those parts are written
+    as they are. Once a part turns out to be formatted differently, the rest
+    of the sequence has its newlines removed and inserted again.
+    """
+    translate_table = TRANSLATE_TABLE
+    line_length = LINE_LENGTH
+    keep_newlines = True
+    delete = b""
+    stats = STATS
+    for part in reversed_parts:
+        if stats is not None:
+            started = time.perf_counter()
+        translated = part.translate(translate_table, delete)
+        if stats is not None:
+            started = stats.add("translate", started, len(part))
+        reverse = translated[::-1]
+        if stats is not None:
+            started = stats.add("reverse", started, len(reverse))
+        if keep_newlines:
+            start = 0
+            end = len(reverse)
+            if reverse.startswith(b"\n"):
+                # The newline that terminates the input sequence is the
+                # responsibility of the caller.
+                start = 1 if last_line_length == 0 else 0
+            elif last_line_length == line_length:
+                write(b"\n")  # Pending from the end of the previous part.
+                last_line_length = 0
+            # A newline at the end is only written when the next base is.
+            pending_newline = end > start and reverse.endswith(b"\n")
+            end -= pending_newline
+            newlines = reverse.count(b"\n", start, end)
+            line_ends = reverse[start + line_length - last_line_length:
+                                end:line_length + 1]
+            bases = end - start - newlines
+            if bases:
+                next_line_length = (
+                    (last_line_length + bases - 1) % line_length + 1)
+            else:
+                next_line_length = last_line_length
+            if (len(line_ends) == newlines == line_ends.count(b"\n") and
+                    (next_line_length == line_length or not pending_newline)):
+                if start != 0 or end != len(reverse):
+                    reverse = memoryview(reverse)[start:end]
+                if stats is not None:
+                    # Checking the newlines takes the place of formatting.
+                    stats.add("format", started, len(reverse))
+                write(reverse)
+                last_line_length = next_line_length
+                continue
+            keep_newlines = False
+            delete = b"\n"
+            reverse = reverse.replace(b"\n", b"")
+        if reverse:
+            formatted = format_lines(reverse, last_line_length)
+            if stats is not None:
+                stats.add("format", started, len(formatted))
+            write(formatted)
+            last_line_length = (
+                (last_line_length + len(reverse) - 1) % line_length + 1)
+    return last_line_length
+
+
+class _BufferWriter:
+    """File-like writer that copies into a preallocated buffer."""
+    def __init__(self, buffer: memoryview, position: int = 0):
+        self.buffer = buffer
+        self.position = position
+
+    def write(self, data: bytes):
+        end = self.position + len(data)
+        self.buffer[self.position:end] = data
+        self.position = end
+
+
+def _sequence_size(sequence_parts: Iterable[bytes]) -> int:
+    if isinstance(sequence_parts, list):
+        return sum(map(len, sequence_parts))
+    return sequence_parts.size
+
+
+def _reverse_complement_shared(shared_name: str,
+                               layout: List[Tuple[int, int]],
+                               out_start: int, block_size: int) -> int:
+    """
+    Worker side of the parallel backend. The records are laid out as
+    (name length, sequence length) pairs at the start of the shared memory
+    and the output is written from out_start onwards. Returns the end of the
+    output.
+    """
+    from multiprocessing import shared_memory
+    shared = shared_memory.SharedMemory(shared_name)
+    try:
+        writer = _BufferWriter(shared.buf, out_start)
+        position = 0
+        for name_length, sequence_length in layout:
+            sequence_start = position + name_length
+            writer.write(shared.buf[position:sequence_start])
+            writer.write(b"\n")
+            position = sequence_start + sequence_length
+            if _write_sequence(reversed(_MappedSequence(
+                    shared.buf, sequence_start, position, block_size)),
+                    writer.write):
+                writer.write(b"\n")
+        return writer.position
+    finally:
+        shared.close()
+
+
+def _submit_shared(pool, batch: List[Tuple[bytes, Iterable[bytes], int]],
+                   block_size: int):
+    """Copy a batch of records into shared memory and submit it to pool."""
+    from multiprocessing import shared_memory
+    in_size = sum(len(name) + size for name, _, size in batch)
+    # Every base gets at most one newline. Pages that are not written to are
+    # never allocated, so it is fine to overestimate.
+    out_size = sum(len(name) + size + size // LINE_LENGTH + 2
+                   for name, _, size in batch)
+    shared = shared_memory.SharedMemory(create=True, size=in_size + out_size)
+    writer = _BufferWriter(shared.buf)
+    layout = []
+    for name, sequence_parts, size in batch:
+        writer.write(name)
+        for part in sequence_parts:
+            writer.write(part)
+        layout.append((len(name), size))
+    return shared, in_size, [pool.submit(
+        _reverse_complement_shared, shared.name, layout, in_size,
+        block_size)]
+
+
+def _reverse_complement_chunk(shared_name: str, start: int, end: int,
+                              out_start: int, last_line_length: int,
+                              last: bool, block_size: int) -> int:
+    """
+    Worker side of splitting a large record. Reverse complements the chunk
+    between start and end into the output at out_start. The chunk continues a
+    line of last_line_length. Returns the end of the output.
+    """
+    from multiprocessing import shared_memory
+    shared = shared_memory.SharedMemory(shared_name)
+    try:
+        writer = _BufferWriter(shared.buf, out_start)
+        last_line_length = _write_sequence(
+            reversed(_MappedSequence(shared.buf, start, end, block_size)),
+            writer.write, last_line_length)
+        # A full line is terminated here, as its newline has been accounted for
+        # in the output offset of the next chunk.
+        if last_line_length == LINE_LENGTH or (last and last_line_length):
+            writer.write(b"\n")
+        return writer.position
+    finally:
+        shared.close()
+
+
+def _submit_split(pool, name: bytes, sequence_parts: Iterable[bytes],
+                  size: int, block_size: int):
+    """
+    Copy a large record into shared memory and submit it to pool in chunks of
+    BATCH_SIZE. The number of bases in each chunk is counted while copying, so
+    the output offset and line position of every chunk is known up front. The
+    chunks can then be written into the output in any order.
+    """
+    from multiprocessing import shared_memory
+    # The input is [0, size) and the output follows it. As in
+    # _submit_shared, every base gets at most one newline.
+    out_size = len(name) + 1 + size + size // LINE_LENGTH + 2
+    shared = shared_memory.SharedMemory(create=True, size=size + out_size)
+    writer = _BufferWriter(shared.buf)
+    chunks = []
+    chunk_start = 0
+    chunk_bases = 0
+    for part in sequence_parts:
+        writer.write(part)
+        chunk_bases += len(part) - part.count(b"\n")
+        if writer.position - chunk_start >= BATCH_SIZE:
+            chunks.append((chunk_start, writer.position, chunk_bases))
+            chunk_start = writer.position
+            chunk_bases = 0
+    if writer.position > chunk_start or not chunks:
+        chunks.append((chunk_start, writer.position, chunk_bases))
+    writer.write(name)
+    writer.write(b"\n")
+    line_length = LINE_LENGTH
+    futures = []
+    bases_before = 0  # The number of bases in the output before the chunk.
+    for index in range(len(chunks) - 1, -1, -1):
+        start, end, bases = chunks[index]
+        out_start = (writer.position + bases_before +
+                     bases_before // line_length)
+        futures.append(pool.submit(
+            _reverse_complement_chunk, shared.name, start, end, out_start,
+            bases_before % line_length, index == 0, block_size))
+        bases_before += bases
+    return shared, size, futures
+
+
+def _reverse_complement_parallel(records: Iterable[Tuple[bytes,
+                                                         Iterable[bytes]]],
+                                 outp: BinaryIO, workers: int,
+                                 block_size: int):
+    """
+    Reverse complement batches of records on a pool of worker processes.
+    Records are passed through shared memory rather than being pickled and
+    the results are written in the order of the input.
+    """
+    # Imported here as these modules take longer to import than it takes to
+    # reverse complement a small file.
+    from concurrent.futures import ProcessPoolExecutor
+    pending = collections.deque()
+
+    def write_result():
+        shared, out_start, futures = pending.popleft()
+        out_end = max(future.result() for future in futures)
+        outp.write(shared.buf[out_start:out_end])
+        shared.close()
+        shared.unlink()
+
+    with ProcessPoolExecutor(workers) as pool:
+        batch = []
+        batch_size = 0
+        for name, sequence_parts in records:
+            size = _sequence_size(sequence_parts)
+            if size > BATCH_SIZE:
+                # A large record is split so it is spread over the workers.
+                if batch:
+                    pending.append(_submit_shared(pool, batch, block_size))
+                pending.append(_submit_split(pool, name, sequence_parts, size,
+                                             block_size))
+            else:
+                batch.append((name, sequence_parts, size))
+                batch_size += size
+                if batch_size < BATCH_SIZE:
+                    continue
+                pending.append(_submit_shared(pool, batch, block_size))
+            del sequence_parts
+            batch = []
+            batch_size = 0
+            # Limit the number of batches that are in memory at once.
+            if len(pending) > 2 * workers:
+                write_result()
+        if batch:
+            pending.append(_submit_shared(pool, batch, block_size))
+        while pending:
+            write_result()
+
+
+def _is_free_threaded() -> bool:
+    """Whether this is a free-threaded build of CPython without the GIL."""
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+def _reverse_complement_batch(batch: List[Tuple[bytes, Iterable[bytes]]]
+                              ) -> List[bytes]:
+    """Thread side of the threaded backend. Returns the output pieces."""
+    pieces = []
+    write = pieces.append
+    for name, sequence_parts in batch:
+        write(name)
+        write(b"\n")
+        if _write_sequence(reversed(sequence_parts), write):
+            write(b"\n")
+    return pieces
+
+
+def _reverse_complement_parts(parts: List[bytes], last_line_length: int,
+                              last: bool, header: bytes = b"") -> List[bytes]:
+    """
+    Thread side of splitting a large record, like _reverse_complement_chunk.
+    Returns the output pieces, starting with header.
+    """
+    pieces = [header] if header else []
+    last_line_length = _write_sequence(reversed(parts), pieces.append,
+                                       last_line_length)
+    if last_line_length == LINE_LENGTH or (last and last_line_length):
+        pieces.append(b"\n")
+    return pieces
+
+
+def _submit_split_parts(submit: Callable, name: bytes,
+                        sequence_parts: Iterable[bytes]):
+    """
+    Submit a large record in chunks of BATCH_SIZE with submit, like
+    _submit_split but without copying the parts. The record is walked from
+    its end, so the line position of a chunk is known as soon as it is
+    gathered. Chunks are submitted in the order of the output while the walk
+    goes on, and a memory mapped record is never read in whole.
+    """
+    header = name + b"\n"
+    parts = []
+    chunk_size = 0
+    bases_before = 0  # The number of bases in the output before the chunk.
+    for part in reversed(sequence_parts):
+        parts.append(part)
+        chunk_size += len(part)
+        if chunk_size >= BATCH_SIZE:
+            parts.reverse()
+            submit(_reverse_complement_parts, parts,
+                   bases_before % LINE_LENGTH, False, header)
+            bases_before += chunk_size - sum(chunk.count(b"\n")
+                                             for chunk in parts)
+            header = b""
+            parts = []
+            chunk_size = 0
+    parts.reverse()
+    submit(_reverse_complement_parts, parts, bases_before % LINE_LENGTH,
+           True, header)
+
+
+def _reverse_complement_threaded(records: Iterable[Tuple[bytes,
+                                                         Iterable[bytes]]],
+                                 outp: BinaryIO, workers: int):
+    """
+    Reverse complement batches of records on a pool of threads, for
+    interpreters without a GIL. Like _reverse_complement_parallel, but the
+    records need not be copied as the threads share them, and the results
+    are written in the order of the input.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    pending = collections.deque()
+
+    def write_result():
+        for piece in pending.popleft().result():
+            outp.write(piece)
+
+    with ThreadPoolExecutor(workers) as pool:
+        def submit(function, *args):
+            pending.append(pool.submit(function, *args))
+            # Limit the number of batches and chunks that are in memory at
+            # once, also within a single large record.
+            if len(pending) > 2 * workers:
+                write_result()
+
+        batch = []
+        batch_size = 0
+        for name, sequence_parts in records:
+            size = _sequence_size(sequence_parts)
+            if size > BATCH_SIZE:
+                # A large record is split so it is spread over the workers.
+                if batch:
+                    submit(_reverse_complement_batch, batch)
+                _submit_split_parts(submit, name, sequence_parts)
+            else:
+                batch.append((name, sequence_parts))
+                batch_size += size
+                if batch_size < BATCH_SIZE:
+                    continue
+                submit(_reverse_complement_batch, batch)
+            del sequence_parts
+            batch = []
+            batch_size = 0
+        if batch:
+            submit(_reverse_complement_batch, batch)
+        while pending:
+            write_result()
+
+
+# WRITEV_SIZE: output is gathered until this many bytes are pending and then
+# written with a single writev call rather than a write call per piece.
+WRITEV_SIZE = 256 * 1024
+# The number of buffers a single writev call accepts.
+_IOV_MAX = os.sysconf("SC_IOV_MAX") if hasattr(os, "sysconf") else 1024
+
+
+class _VectoredWriter:
+    """
+    File-like writer that keeps references to the pieces it is given and
+    writes them to a file descriptor with os.writev once size bytes are
+    pending. Pieces that could change or be released after write returns,
+    anything but bytes or a view of bytes, are written right away.
+    """
+    def __init__(self, fileno: int, size: Optional[int] = None):
+        self.fd = fileno
+        self.size = size or WRITEV_SIZE
+        self._buffers = []
+        self._pending = 0
+
+    def write(self, data: bytes) -> int:
+        size = len(data)
+        self._buffers.append(data)
+        self._pending += size
+        if self._pending >= self.size or not (
+                type(data) is bytes or
+                type(data) is memoryview and type(data.obj) is bytes):
+            self.flush()
+        return size
+
+    def flush(self):
+        buffers = self._buffers
+        index = 0
+        while index < len(buffers):
+            written = os.writev(self.fd, buffers[index:index + _IOV_MAX])
+            # Skip the buffers that were written completely.
+            while index < len(buffers) and written >= len(buffers[index]):
+                written -= len(buffers[index])
+                index += 1
+            if written:  # Only part of this buffer was written.
+                buffers[index] = memoryview(buffers[index])[written:]
+        self._buffers = []
+        self._pending = 0
+
+
+# File objects that write exactly what they are given to their descriptor.
+_FILE_WRITERS = (io.FileIO, io.BufferedWriter, io.BufferedRandom)
+
+
+def _vectored_writer(outp: BinaryIO) -> Optional[_VectoredWriter]:
+    """Return a _VectoredWriter for the file descriptor of outp, if any."""
+    if not hasattr(os, "writev") or type(outp) not in _FILE_WRITERS:
+        return None
+    try:
+        fileno = outp.fileno()
+    except (AttributeError, OSError):  # io.UnsupportedOperation is an OSError
+        return None
+    # Anything that is still in the buffer of outp goes first.
+    outp.flush()
+    return _VectoredWriter(fileno)
+
+
+# BGZF blocks hold at most 64KiB of compressed data. Like bgzip, a little
+# less than that is put into every block, so even incompressible data fits.
+BGZF_BLOCK_SIZE = 0xff00
+# Members of plain gzip output can be larger, which compresses slightly better.
+GZIP_MEMBER_SIZE = 1024 * 1024
+
+# A gzip header with the BC extra field that holds the size of a BGZF block.
+_BGZF_HEADER = struct.Struct("<4sIBBHBBHH")
+# The empty block that marks the end of a BGZF file.
+_BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b00"
+                          "03000000000000000000")
+# A gzip header without extra fields, modification time or file name.
+_GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+
+def _compress_member(data: bytes, bgzf: bool, level: int) -> bytes:
+    """Compress data into a single gzip member, a BGZF block if bgzf."""
+    import zlib
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = compressor.compress(data) + compressor.flush()
+    trailer = struct.pack("<II", zlib.crc32(data), len(data))
+    if bgzf:
+        # The block size is stored minus one, so 64KiB fits in 16 bits.
+        block_size = _BGZF_HEADER.size + len(deflated) + len(trailer)
+        header = _BGZF_HEADER.pack(b"\x1f\x8b\x08\x04", 0, 0, 0xff, 6,
+                                   ord("B"), ord("C"), 2, block_size - 1)
+    else:
+        header = _GZIP_HEADER
+    return header + deflated + trailer
+
+
+class CompressedWriter:
+    """
+    Write BGZF or concatenated gzip members to a binary file. The members are
+    compressed on a pool of threads, zlib releases the GIL while it deflates,
+    and written in order. Both formats can be read by any gzip reader. BGZF
+    files can also be indexed with bgzip or samtools for random access.
+
+    Closing the writer writes the remaining data and, for BGZF, the end of
+    file marker. Leaving it as a context manager with an exception does not.
+    The underlying file is not closed.
+    """
+    def __init__(self, raw: BinaryIO, compression: str = "bgzf",
+                 threads: Optional[int] = None, level: int = 6):
+        if compression not in ("bgzf", "gzip"):
+            raise ValueError(f"unknown compression: {compression}")
+        import concurrent.futures
+        self.raw = raw
+        self.bgzf = compression == "bgzf"
+        self.level = level
+        self.member_size = BGZF_BLOCK_SIZE if self.bgzf else GZIP_MEMBER_SIZE
+        self.threads = threads or os.cpu_count() or 1
+        self._pool = concurrent.futures.ThreadPoolExecutor(self.threads)
+        self._pending = collections.deque()
+        self._buffer = bytearray()
+        self.closed = False
+
+    def _submit(self, data: bytes):
+        self._pending.append(self._pool.submit(
+            _compress_member, data, self.bgzf, self.level))
+        # Limit the number of members that are in memory at once.
+        while len(self._pending) > 2 * self.threads:
+            self.raw.write(self._pending.popleft().result())
+
+    def write(self, data: bytes) -> int:
+        buffer = self._buffer
+        buffer += memoryview(data)  # += would add to NumPy arrays.
+        member_size = self.member_size
+        if len(buffer) >= member_size:
+            end = len(buffer) - len(buffer) % member_size
+            for start in range(0, end, member_size):
+                self._submit(bytes(buffer[start:start + member_size]))
+            del buffer[:end]
+        return len(data)
+
+    def flush(self):
+        """Compress and write everything that has been written so far."""
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+        while self._pending:
+            self.raw.write(self._pending.popleft().result())
+        self.raw.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        if self.bgzf:
+            self.raw.write(_BGZF_EOF)
+            self.raw.flush()
+        self._pool.shutdown()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        # After an error the output is left incomplete, rather than ending it
+        # as if it were a whole file.
+        try:
+            if exc_info[0] is None:
+                self.close()
+        finally:
+            self._pool.shutdown(cancel_futures=True)
+            self.closed = True
+
+
+def _write_records(records: Iterable[Tuple[bytes, Iterable[bytes]]],
+                   outp: BinaryIO):
+    stats = STATS
+    for name, sequence_parts in records:
         outp.write(name)
         outp.write(b"\n")
-        last_line_length = 0
-        for part in reversed(sequence_parts):
-            translated = part.translate(translate_table, b'\n')
-            reverse = translated[::-1]
-            offset = line_length - last_line_length
-            outp.write(reverse[:offset])  # Fill out remaining bytes on the line.
-            outp.write(b"\n")
-            fasta_lines = [reverse[i:i + line_length]
-                           for i in range(offset, len(reverse), line_length)]
-            last_line_length = len(fasta_lines[-1])
-            outp.write(b"\n".join(fasta_lines))
-        outp.write(b"\n")  # Terminate entire sequence with final newline.
-        # This del statement just before a new sequence is read ensures there
-        # is only one sequence in memory at the time.
+        reversed_parts = reversed(sequence_parts)
+        if stats is not None and not isinstance(sequence_parts, list):
+            reversed_parts = stats.parts(reversed_parts)
+        if _sequence_size(sequence_parts) < NUMPY_SIZE:
+            format_lines = _format_lines
+        else:
+            format_lines = _format_lines_numpy
+        if _write_sequence(reversed_parts, outp.write,
+                           format_lines=format_lines):
+            outp.write(b"\n")  # Terminate sequence with final newline.
+        # This del statement just before a new sequence is read ensures
+        # there is only one sequence in memory at the time.
         del sequence_parts
+
+
+# Blocks with at least this many records, that each have their sequence on a
+# single line, are reverse complemented in bulk.
+SHORT_RECORDS = 16
+
+
+def _is_short_records(block: bytes) -> bool:
+    """
+    Quick check whether a block of complete records consists of enough
+    records of two lines, a name and a sequence.
+    """
+    records = block.count(b"\n>") + block.startswith(b">")
+    return records >= SHORT_RECORDS and block.count(b"\n") == 2 * records
+
+
+def _reverse_complement_block(block: bytes) -> Optional[bytes]:
+    """
+    Reverse complement a block of complete records that each have their
+    sequence on a single line. Rather than looping over the records, all
+    sequences are joined, translated and reversed at once. Reversing the
+    joined sequences also reverses their order, which is undone by
+    reversing the list of lines. Returns None for other blocks.
+    """
+    if not block.startswith(b">") or not block.endswith(b"\n"):
+        return None
+    lines = block.split(b"\n")
+    if len(lines) % 2 != 1:
+        return None
+    sequences = lines[1::2]
+    joined = b"\n".join(sequences)
+    # Every other line starts with ">" when no sequence contains one, as
+    # many lines do as there are records.
+    if (b">" in joined or not all(sequences) or
+            block.count(b"\n>") + 1 != len(sequences)):
+        return None
+    stats = STATS
+    if stats is not None:
+        started = time.perf_counter()
+    translated = joined.translate(TRANSLATE_TABLE)
+    if stats is not None:
+        started = stats.add("translate", started, len(joined))
+    reverse = translated[::-1].split(b"\n")
+    reverse.reverse()
+    if stats is not None:
+        started = stats.add("reverse", started, len(joined))
+    if max(map(len, sequences)) > LINE_LENGTH:
+        reverse = [sequence if len(sequence) <= LINE_LENGTH else
+                   _format_lines(sequence, 0) for sequence in reverse]
+    lines[1::2] = reverse
+    block = b"\n".join(lines)
+    if stats is not None:
+        stats.add("format", started, len(block))
+    return block
+
+
+def _write_block(records: bytes, outp: BinaryIO, block_size: int):
+    reverse = _reverse_complement_block(records)
+    if reverse is None:
+        _write_records(parse_fasta(io.BytesIO(records), block_size), outp)
+    else:
+        outp.write(reverse)
+
+
+def _reverse_complement_short_records(inp: BinaryIO, outp: BinaryIO,
+                                      block_size: int, block: bytes
+                                      ) -> Optional[bytes]:
+    """
+    Reverse complement input with many short records, starting with block
+    that has already been read. The input is cut at the last record that
+    starts in each block. Blocks of records that cannot be done in bulk are
+    parsed and written as usual. A record that is larger than a block is left
+    to the other engines, which keep large records out of memory. Returns
+    the start of the input that is left then, or None when all is done.
+    """
+    parts = []
+    pending = 0
+    while block:
+        end = block.rfind(b"\n>") + 1
+        if end:
+            parts.append(block[:end])
+            _write_block(b"".join(parts), outp, block_size)
+            parts = [block[end:]]
+            pending = len(parts[0])
+        else:
+            parts.append(block)
+            pending += len(block)
+            if pending > block_size:
+                return b"".join(parts)
+        block = inp.read(block_size)
+    records = b"".join(parts)
+    if records:
+        _write_block(records, outp, block_size)
+    return None
+
+
+def reverse_complement(inp: BinaryIO, outp: BinaryIO,
+                       workers: Optional[int] = None,
+                       block_size: Optional[int] = None,
+                       max_memory: Optional[int] = None,
+                       compression: Optional[str] = None,
+                       pipeline: bool = False, fastq: bool = False,
+                       threads: Optional[bool] = None):
+    """
+    Reverse complement the FASTA records in inp and write them to outp. With
+    compression set to "bgzf" or "gzip" the output is compressed, see
+    CompressedWriter. With pipeline, reading and writing are done on
+    separate threads so they overlap with the computation. With fastq, inp
+    holds FASTQ records of which the qualities are reversed as well. With
+    threads, multiple workers are threads rather than processes. By default
+    they are threads when the interpreter runs without a GIL, and then there
+    is a worker for every CPU. Otherwise there is one worker by default.
+    """
+    if workers is None:
+        workers = (os.cpu_count() or 1) if _is_free_threaded() else 1
+    if compression is not None:
+        with CompressedWriter(outp, compression) as compressed:
+            reverse_complement(inp, compressed, workers, block_size,
+                               max_memory, pipeline=pipeline, fastq=fastq,
+                               threads=threads)
+        return
+    vectored = _vectored_writer(outp)
+    if vectored is not None:
+        reverse_complement(inp, vectored, workers, block_size, max_memory,
+                           pipeline=pipeline, fastq=fastq, threads=threads)
+        outp.flush()
+        return
+    block_size = block_size or BLOCK_SIZE
+    if pipeline:
+        # Memory mapped and compressed input need no reader thread.
+        reader = None
+        if not _is_compressed(inp) and not _is_mappable(inp):
+            reader = inp = _ThreadedReader(_read_blocks(inp, block_size))
+        try:
+            with _ThreadedWriter(outp, block_size) as writer:
+                reverse_complement(inp, writer, workers, block_size,
+                                   max_memory, fastq=fastq, threads=threads)
+        finally:
+            if reader is not None:
+                reader.close()
+        return
+    if _is_compressed(inp):
+        reader = _ThreadedReader(_inflate(inp, block_size))
+        try:
+            reverse_complement(reader, outp, workers, block_size, max_memory,
+                               fastq=fastq, threads=threads)
+        finally:
+            reader.close()
+        return
+    stats = STATS
+    if stats is not None:
+        inp = _TimedReader(inp, stats)
+        outp = _TimedWriter(outp, stats)
+    if fastq:
+        _reverse_complement_fastq(inp, outp, block_size)
+        outp.flush()
+        return
+    if workers == 1:
+        block = inp.read(block_size)
+        if _is_short_records(block[:block.rfind(b"\n>") + 1]):
+            block = _reverse_complement_short_records(inp, outp, block_size,
+                                                      block)
+            if block is None:
+                outp.flush()
+                return
+        # Give the block back for the other engines.
+        if hasattr(inp, "seekable") and inp.seekable():
+            inp.seek(-len(block), io.SEEK_CUR)
+        else:
+            inp = _PrefixedReader(block, inp)
+    mapped = _map_input(inp)
+    if mapped is None:
+        records = parse_fasta(inp, block_size, max_memory)
+    else:
+        records = parse_mapped_fasta(mapped, inp.tell(), block_size)
+    if threads is None:
+        threads = _is_free_threaded()
+    if workers > 1 and threads:
+        _reverse_complement_threaded(records, outp, workers)
+    elif workers > 1:
+        _reverse_complement_parallel(records, outp, workers, block_size)
+    else:
+        _write_records(records if stats is None else stats.records(records),
+                       outp)
+    if mapped is not None:
+        mapped.close()
+        inp.seek(0, io.SEEK_END)  # The entire input has been consumed.
     outp.flush()
 
 
-if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        out = open(sys.argv[1], "wb")
+# The server sends its output in frames that start with their length. An
+# empty frame ends the output, a frame of _ERROR_FRAME holds an error message.
+_FRAME_HEADER = struct.Struct("<I")
+_ERROR_FRAME = 0xffffffff
+# Options of reverse_complement that clients may set.
+_SERVER_OPTIONS = ("block_size", "max_memory", "compression", "fastq")
+
+
+class _FrameWriter:
+    """File-like writer that sends framed output over a socket."""
+    def __init__(self, connection: socket.socket,
+                 size: Optional[int] = None):
+        self.connection = connection
+        self.size = size or WRITEV_SIZE
+        self._buffer = bytearray()
+
+    def write(self, data: bytes):
+        # Through a memoryview, as += would add to NumPy arrays.
+        self._buffer += memoryview(data)
+        if len(self._buffer) >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.connection.sendall(
+                _FRAME_HEADER.pack(len(self._buffer)) + self._buffer)
+            self._buffer.clear()
+
+    def close(self, error: Optional[str] = None):
+        if error is None:
+            self.flush()
+            self.connection.sendall(_FRAME_HEADER.pack(0))
+        else:
+            self.connection.sendall(_FRAME_HEADER.pack(_ERROR_FRAME) +
+                                    error.encode())
+
+
+def _handle_connection(connection: socket.socket):
+    """
+    Reverse complement the input of one client. The input starts with a
+    line of JSON with options for reverse_complement.
+    """
+    with connection, connection.makefile("rb") as inp:
+        outp = _FrameWriter(connection)
+        try:
+            options = json.loads(inp.readline() or b"{}")
+            reverse_complement(inp, outp, **{
+                option: options[option] for option in _SERVER_OPTIONS
+                if option in options})
+        except Exception as error:
+            print(f"revcomp server: {error!r}", file=sys.stderr)
+            try:
+                outp.close(error=repr(error))
+                # Closing with unread input would reset the connection and
+                # the client could lose the error, so read up to its end.
+                connection.shutdown(socket.SHUT_WR)
+                while connection.recv(WRITEV_SIZE):
+                    pass
+            except OSError:  # The client is gone.
+                pass
+        else:
+            outp.close()
+
+
+def _fork_server(listener: socket.socket) -> int:
+    """Fork a process that handles connections until it is terminated."""
+    pid = os.fork()
+    if pid == 0:
+        import signal
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        try:
+            while True:
+                connection, _ = listener.accept()
+                _handle_connection(connection)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def serve(path: str, workers: int = 1):
+    """
+    Serve clients such as revcomp_client.py on a Unix socket. Connections
+    are handled by a pool of workers that are forked up front, so there is
+    no start up time for every file. Workers that exit are replaced.
+    """
+    import signal
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        os.unlink(path)  # Left behind by a previous server.
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(128)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    children = [_fork_server(listener) for _ in range(workers)]
+    try:
+        while True:
+            pid, _ = os.wait()
+            if pid in children:
+                children.remove(pid)
+                children.append(_fork_server(listener))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        listener.close()
+        os.unlink(path)
+
+
+def main():
+    global STATS
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("output", nargs="?",
+                        help="Output file. Defaults to stdout.")
+    parser.add_argument("-w", "--workers", type=int,
+                        help="Number of workers. Default: the number of CPUs "
+                             "when Python runs without a GIL, otherwise 1.")
+    parser.add_argument("-b", "--block-size", type=int,
+                        help=f"Size of the blocks that are read and processed "
+                             f"at once. Default: {BLOCK_SIZE}, see "
+                             f"calibrate.py.")
+    parser.add_argument("-m", "--max-memory", type=parse_size,
+                        help="When reading from a pipe, sequences larger "
+                             "than this are spilled to a temporary file. "
+                             "Accepts K, M and G suffixes.")
+    parser.add_argument("-z", "--compression", choices=("bgzf", "gzip"),
+                        help="Compress the output as BGZF blocks or gzip "
+                             "members on all CPUs.")
+    parser.add_argument("-t", "--threads", action="store_true",
+                        default=None,
+                        help="Use threads rather than processes for "
+                             "--workers. Default: only when Python runs "
+                             "without a GIL.")
+    parser.add_argument("-p", "--pipeline", action="store_true",
+                        help="Read and write on separate threads.")
+    parser.add_argument("-q", "--fastq", action="store_true",
+                        help="The input is FASTQ rather than FASTA.")
+    parser.add_argument("--stats", metavar="FILE",
+                        default=os.environ.get("REVCOMP_STATS"),
+                        help="Write the time and bytes of every stage as "
+                             "JSON to FILE, or stderr for '-'. Default: "
+                             "$REVCOMP_STATS.")
+    parser.add_argument("-i", "--input",
+                        help="Input FASTA file. Defaults to stdin.")
+    parser.add_argument("-r", "--regions", nargs="+", metavar="REGION",
+                        help="Only reverse complement these records or "
+                             "name:start-end regions of the input file. "
+                             "A samtools compatible .fai index is created "
+                             "next to it if there is none.")
+    parser.add_argument("--in-place", action="store_true",
+                        help="Reverse complement the input file itself "
+                             "rather than writing the output. Lines keep "
+                             "the width they have in the input.")
+    parser.add_argument("--serve", metavar="SOCKET",
+                        help="Serve revcomp_client.py on this Unix socket "
+                             "with --workers processes.")
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.workers or 1)
+        return
+    if args.stats and STATS is None:
+        STATS = Stats()
+    if args.regions and not args.input:
+        parser.error("--regions requires an --input file")
+    if args.in_place:
+        if not args.input:
+            parser.error("--in-place requires an --input file")
+        reverse_complement_in_place(args.input, block_size=args.block_size)
+        return
+    if args.output:
+        out = open(args.output, "wb")
     else:
         out = sys.stdout.buffer
-    reverse_complement(sys.stdin.buffer, out)
+    if args.regions:
+        reverse_complement_regions(args.input, args.regions, out,
+                                   block_size=args.block_size)
+        return
+    inp = open(args.input, "rb") if args.input else sys.stdin.buffer
+    reverse_complement(inp, out, workers=args.workers,
+                       block_size=args.block_size, max_memory=args.max_memory,
+                       compression=args.compression, pipeline=args.pipeline,
+                       fastq=args.fastq, threads=args.threads)
+    if STATS is not None:
+        STATS.write_report(args.stats)
+
+
+if __name__ == "__main__":
+    main()
 
 
 # The most common Python implementation, CPython, is written in C. Therefore
@@ -115,20 +1894,17 @@ if __name__ == "__main__":
 #    the translate method on the bytes object to also remove the '\n'
 #    characters. I didn't know this was possible until I saw it in the other
 #    submitted programs. The python standard library has many gems!
-# 5. Reformatting the sequence for printing. Unfortunately I have not found
-#    a fast method for this, so this program will use the slicing operator
-#    to create a new object for *every single line* and then join them using
-#    the 'join()' method which allows putting newlines in between. It would be
-#    much faster if there were a method to copy the sequence to a new buffer
-#    with newlines in between, but there is no standard library that does this
-#    as far as I know. This is the slowest part of the program taking roughly
-#    40% of the execution time creating all this individual objects. When this
-#    becomes a problem in the real-world you can write a custom C extension
-#    (either by hand or using Cython) that tackles this problem. But in this
-#    benchmark game it would of course be cheating to use C.
-#    I have tried other methods, including working with a mutable bytesarray
-#    and working with ctypes.memmove, but simple b"\n".join(fasta_lines) is
-#    both the most simple and efficient.
+# 5. Reformatting the sequence for printing. Input that already has lines
+#    of 60 does not need formatting at all: the newlines end up in the right
+#    place after reversing, so they are simply not removed in step 4. This is
+#    checked for every block with a few bytes methods and the program falls
+#    back to formatting as soon as a block does not fit. Otherwise, for
+#    blocks of a few hundred lines, the slicing operator creates a new object
+#    for every line and the 'join()' method puts newlines in between. For
+#    larger blocks creating all these individual objects is the slowest part
+#    of the program. There the bases are copied into a preallocated bytearray
+#    column by column with extended slices instead, so there is one slice
+#    assignment per column rather than an object per line.
 #
 # The above described implementation has one disadvantage. Sequences
 # are treated as large strings. But these sequences can be several megabytes.
@@ -153,3 +1929,118 @@ if __name__ == "__main__":
 # We have to remember the length of the last line we have written in order to
 # put the newline at the desired line length. This is however fairly easy to
 # implement.
+#
+# When the input is a regular file there is no need to keep the list of
+# blocks around at all. The file is memory mapped and each sequence is walked
+# from its end to its start, slicing one block at a time out of the map. Only
+# the block that is being worked on is copied and the pages that have been
+# processed are handed back to the OS. A sequence of several gigabytes can
+# then be reverse complemented using little more than BLOCK_SIZE memory.
+#
+# With multiple workers the records are grouped into batches of at least
+# BATCH_SIZE and every batch is handled by a separate process. Pickling
+# sequences to send them to another process is slow, so each batch is copied
+# once into shared memory instead. The worker writes its output into the same
+# shared memory and the main process writes the batches out in input order.
+# A record that is larger than BATCH_SIZE is split into chunks instead, so a
+# single large sequence is also spread over the workers. While the record is
+# copied into shared memory the bases in each chunk are counted. That is
+# enough to compute where each chunk's output starts and how long the line it
+# continues is, so the workers can write their chunks in any order.
+#
+# A pipe cannot be memory mapped, so streamed input still keeps each
+# sequence in memory until the next one starts. With max_memory set, the
+# blocks of a sequence that grows beyond that budget are appended to a
+# temporary file instead. Reading them back from the end in BLOCK_SIZE
+# segments feeds the same reverse loop, so memory stays near the budget
+# regardless of the size of the sequence.
+#
+# Compressed input is recognised by its gzip or zlib header and decompressed
+# on a separate thread. zlib releases the GIL while it inflates, so the next
+# blocks are decompressed while the main thread complements and formats the
+# previous ones. A bounded queue of READ_AHEAD blocks sits in between so the
+# decompressor cannot run arbitrarily far ahead. This is also faster than
+# piping through zcat, which costs an extra copy through a pipe.
+#
+# Compressing the output with a single gzip stream is slower than everything
+# else combined. Instead the output is cut into independent gzip members
+# that are deflated on a pool of threads while the main thread continues.
+# A stream of concatenated members is still a valid gzip file. The BGZF
+# variant uses members of at most 64KiB that record their own size, which
+# is what allows bgzip and samtools to index the result.
+#
+# When reading from a pipe or a network filesystem, the time spent waiting in
+# read and write calls adds to the computation. With pipeline set, blocks are
+# read on one thread and output is gathered into batches that are written on
+# another. Both threads spend their time in system calls, which release the
+# GIL. Bounded queues between the stages keep the amount of memory in flight
+# to a few blocks. Memory mapped input has no read calls and keeps using the
+# map.
+#
+# With small blocks, or many records, most of the time went to write calls
+# for small pieces: names, newlines and the parts of a line. When the output
+# has a file descriptor, the pieces are now only collected and written with
+# one os.writev call for every WRITEV_SIZE bytes. Unlike a BufferedWriter this
+# does not copy the pieces into a buffer first.
+#
+# Sometimes only a few records or regions of a large reference are needed.
+# Scanning the whole file for them is wasteful, so a samtools compatible
+# .fai index is built once and stored next to the file. Because all lines of
+# a record have the same length, the index gives the byte offset of any base
+# with a division. Only the bytes of the requested regions are then read
+# from the memory map, and reversed with the same code as whole records.
+#
+# Sequencing reads are only a few hundred bases each. For those the loop over
+# the records costs much more than translating and reversing them. When the
+# input starts with a block of records that have their sequence on a single
+# line, the input is instead cut into blocks of whole records. The sequences
+# of a block are joined with newlines, translated and reversed at once, which
+# reverses the order of the records too. Splitting the result and reversing
+# the list of lines puts every sequence back under its own name. Blocks that
+# turn out to have other records are handled record by record.
+#
+# FASTQ records have a name, a sequence, a line starting with + and a line
+# with a quality for every base. Every record has exactly four lines, so a
+# block split into lines holds whole records up to the last multiple of four.
+# The sequences and qualities are then every fourth line and are reversed in
+# bulk, the same way as short FASTA records.
+#
+# Formatting is still the largest part of the work for input that is not
+# formatted like the output. For large sequences it is done with NumPy when
+# that is installed: the lines are copied into an array with a column for
+# the newlines, which takes a single strided copy. The sequence is still
+# complemented with bytes.translate, which is faster than a NumPy lookup
+# table and removes the newlines in the same pass. Importing NumPy takes
+# about as long as formatting 100MB this way, so it is only imported for
+# sequences of at least NUMPY_SIZE that need formatting.
+#
+# Writing the output to a new file needs as much disk space again as the
+# input. When the input is not needed anymore, it can be reverse complemented
+# in place instead. The .fai index gives the byte offset of every base, so
+# blocks with the same number of bases are taken from the start and the end
+# of a record, complemented, reversed and written into each other's place.
+# The newlines stay where they were, which is why every line but the last
+# must be of the same width.
+#
+# Many small files are dominated by starting Python and importing modules,
+# not by reverse complementing them. reverse_complement.py --serve forks a
+# pool of warm processes that accept connections on a Unix socket, and
+# revcomp_client.py only imports what it needs to stream its input there and
+# the output back. The output is framed, so an error after the first output
+# can be told apart from output that simply ended.
+#
+# Nightly jobs over thousands of files are better served by doing whole files
+# in parallel than by splitting every file over the workers. revcomp_batch.py
+# hands the files to a pool of processes, the largest first, so the last file
+# that is started is a small one and no worker idles while another finishes.
+#
+# Free-threaded builds of CPython can run bytes.translate, slicing and join
+# on several threads at once. There the workers are threads that share the
+# records, rather than processes that need the records copied into shared
+# memory. Large records are still split into chunks, but walked from their
+# end, so the line position of a chunk is known as soon as it is gathered.
+# Only a few chunks are in flight at once and the results are written in
+# order, so a memory mapped record is never read in whole. With the
+# GIL, threads would take turns, so processes remain the default there. For
+# the same reason all CPUs are only used by default without the GIL, as
+# starting processes costs more than small inputs gain from them.
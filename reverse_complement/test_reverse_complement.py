@@ -1,16 +1,330 @@
+import contextlib
+import gzip
+import hashlib
 import io
+import json
+import os
+import subprocess
 import sys
+import tempfile
+import time
+import unittest.mock
 
+import revcomp_batch
+import revcomp_client
+import reverse_complement as revcomp
 from reverse_complement import reverse_complement
 
+
+@contextlib.contextmanager
+def patched(name: str, value):
+    """Set a global of reverse_complement, and restore it afterwards."""
+    saved = getattr(revcomp, name)
+    setattr(revcomp, name, value)
+    try:
+        yield
+    finally:
+        setattr(revcomp, name, saved)
+
+
+def run(inp, **kwargs) -> bytes:
+    outp = io.BytesIO()
+    reverse_complement(inp, outp, **kwargs)
+    return outp.getvalue()
+
+
 if __name__ == "__main__":
-    with open("revcomp-input.txt", "rb") as inp:
-        outp = io.BytesIO()
-        reverse_complement(inp, outp)
     with open("revcomp-output.txt", "rb") as testf:
         correct = testf.read()
-        if outp.getvalue() == correct:
-            print("Sucess!")
-        else:
-            print("Failure!")
-            sys.exit(1)
+    results = {}
+    # Small blocks make sure sequences span many blocks and small batches
+    # make sure the records are spread over the workers.
+    for block_size, batch_size in ((revcomp.BLOCK_SIZE, revcomp.BATCH_SIZE),
+                                   (100, 100)):
+        with patched("BATCH_SIZE", batch_size):
+            for workers in (1, 2):
+                with open("revcomp-input.txt", "rb") as inp:
+                    results[f"mmap {block_size} {workers}"] = run(
+                        inp, workers=workers, block_size=block_size)
+                    inp.seek(0)
+                    results[f"stream {block_size} {workers}"] = run(
+                        io.BytesIO(inp.read()), workers=workers,
+                        block_size=block_size)
+                    inp.seek(0)
+                    results[f"spilled {block_size} {workers}"] = run(
+                        io.BytesIO(inp.read()), workers=workers,
+                        block_size=block_size, max_memory=1000)
+                    inp.seek(0)
+                    results[f"gzip {block_size} {workers}"] = run(
+                        io.BytesIO(gzip.compress(inp.read())), workers=workers,
+                        block_size=block_size)
+                    inp.seek(0)
+                    results[f"pipeline {block_size} {workers}"] = run(
+                        io.BytesIO(inp.read()), workers=workers,
+                        block_size=block_size, pipeline=True)
+                    inp.seek(0)
+                    # Threads are only used by default without a GIL.
+                    results[f"threads {block_size} {workers}"] = run(
+                        inp, workers=workers, block_size=block_size,
+                        threads=True)
+    failures = [mode for mode, result in results.items() if result != correct]
+    # Output to a file descriptor is gathered and written with writev.
+    for workers in (1, 2):
+        with open("revcomp-input.txt", "rb") as inp, \
+                tempfile.TemporaryFile() as outp:
+            reverse_complement(inp, outp, workers=workers, block_size=100)
+            outp.seek(0)
+            if outp.read() != correct:
+                failures.append(f"file output {workers}")
+    # gzip.open() has the file descriptor of the compressed file, which must
+    # not be memory mapped.
+    with tempfile.TemporaryDirectory() as gzip_dir:
+        with open("revcomp-input.txt", "rb") as inp, \
+                gzip.open(gzip_dir + "/input.fa.gz", "wb") as outp:
+            outp.write(inp.read())
+        for workers in (1, 2):
+            with gzip.open(gzip_dir + "/input.fa.gz", "rb") as inp:
+                if run(inp, workers=workers) != correct:
+                    failures.append(f"gzip.open input {workers}")
+        # Neither must its descriptor be written to directly.
+        with open("revcomp-input.txt", "rb") as inp, \
+                gzip.open(gzip_dir + "/output.fa.gz", "wb") as outp:
+            reverse_complement(inp, outp)
+        with gzip.open(gzip_dir + "/output.fa.gz", "rb") as result:
+            if result.read() != correct:
+                failures.append("gzip.open output")
+    for compression in ("gzip", "bgzf"):
+        with open("revcomp-input.txt", "rb") as inp:
+            compressed = run(inp, compression=compression)
+        if gzip.decompress(compressed) != correct:
+            failures.append(compression)
+    # compressed now holds the BGZF output.
+    if not compressed.endswith(revcomp._BGZF_EOF):
+        failures.append("bgzf end of file marker")
+    # A failed run must not look like a complete file.
+    outp = io.BytesIO()
+    with open("revcomp-input.txt", "rb") as inp:
+        try:
+            reverse_complement(io.BytesIO(inp.read() + b">a"), outp,
+                               compression="bgzf")
+            failures.append("bgzf truncated input")
+        except EOFError:
+            if outp.getvalue().endswith(revcomp._BGZF_EOF):
+                failures.append("bgzf end of file marker after an error")
+    with tempfile.TemporaryDirectory() as directory:
+        in_place = directory + "/revcomp-input.txt"
+        with open("revcomp-input.txt", "rb") as inp, \
+                open(in_place, "wb") as outp:
+            outp.write(inp.read())
+        revcomp.reverse_complement_in_place(in_place, block_size=100)
+        with open(in_place, "rb") as result:
+            if result.read() != correct:
+                failures.append("in place")
+    # Regions are read through a .fai index. The last 60 bases of THREE are
+    # the first line of its reverse complement.
+    with tempfile.TemporaryDirectory() as index_dir:
+        outp = io.BytesIO()
+        revcomp.reverse_complement_regions(
+            "revcomp-input.txt", ["ONE", "TWO", "THREE:4941-5000"], outp,
+            block_size=100, index_path=index_dir + "/revcomp-input.txt.fai")
+    one, two, three = [record.partition(b"\n")[2]
+                       for record in correct.split(b">")[1:]]
+    expected = (b">ONE/rc\n" + one + b">TWO/rc\n" + two +
+                b">THREE:4941-5000/rc\n" + three[:61])
+    if outp.getvalue() != expected:
+        failures.append("regions")
+    # Many records with a single sequence line are done in bulk. The result
+    # must be the same as when they are done one by one.
+    reads = b"".join(b">read%d\n%s\n" % (number, b"ACGTTGCA"[number % 8:] * 5)
+                     for number in range(100))
+    bulk = run(io.BytesIO(reads), block_size=1000)
+    with patched("SHORT_RECORDS", len(reads)):
+        if bulk != run(io.BytesIO(reads), block_size=1000):
+            failures.append("bulk short records")
+    # A record larger than a block is left to the other engines, which spill
+    # it rather than gathering it in memory.
+    with open("revcomp-input.txt", "rb") as inp:
+        large = inp.read()
+    mixed = run(io.BytesIO(reads + large + reads), block_size=1000,
+                max_memory=2000)
+    if mixed != bulk + correct + bulk:
+        failures.append("short records before a large one")
+    # Without a GIL, all CPUs are used by default.
+    used = []
+    with patched("_is_free_threaded", lambda: True), \
+            patched("_reverse_complement_threaded",
+                    lambda records, outp, workers: used.append(workers)), \
+            unittest.mock.patch.object(os, "cpu_count", lambda: 4), \
+            open("revcomp-input.txt", "rb") as inp:
+        reverse_complement(inp, io.BytesIO())
+    if used != [4]:
+        failures.append("default workers")
+    # The threads walk a large record from its end and only a few chunks of
+    # it are in memory at once, so output starts before the walk is done.
+    consumed = []
+    written = []
+
+    class Parts(list):
+        def __reversed__(self):
+            for part in super().__reversed__():
+                consumed.append(part)
+                yield part
+
+    class Output(io.BytesIO):
+        def write(self, data):
+            written.append(len(consumed))
+            return super().write(data)
+
+    sequence = b"ACGTTGCA" * 6000
+    parts = Parts(sequence[start:start + 100]
+                  for start in range(0, len(sequence), 100))
+    outp = Output()
+    with patched("BATCH_SIZE", 1000):
+        revcomp._reverse_complement_threaded([(b">a", parts)], outp, 2)
+    expected = run(io.BytesIO(b">a\n" + sequence + b"\n"))
+    if outp.getvalue() != expected or not 0 < written[0] < len(parts):
+        failures.append("threads large record")
+    fastq = run(io.BytesIO(b"@a\nACGTT\n+a\nABCDE\n@b\nGGC\n+\nFGH\n"),
+                block_size=7, fastq=True)
+    if fastq != b"@a\nAACGT\n+a\nEDCBA\n@b\nGCC\n+\nHGF\n":
+        failures.append("fastq")
+    # Formatting with NumPy, or without it when it is not installed.
+    with open("revcomp-input.txt", "rb") as inp, patched("NUMPY_SIZE", 0):
+        if run(io.BytesIO(inp.read()), block_size=100) != correct:
+            failures.append("numpy")
+        inp.seek(0)
+        compressed = run(io.BytesIO(inp.read()), block_size=100,
+                         compression="gzip")
+        if gzip.decompress(compressed) != correct:
+            failures.append("numpy gzip")
+    with open("revcomp-input.txt", "rb") as inp, \
+            patched("STATS", revcomp.Stats()):
+        instrumented = run(io.BytesIO(inp.read()), block_size=100)
+        input_size = inp.tell()
+        report = revcomp.STATS.report()
+    # Some bytes at the start are read twice to detect the input format.
+    computed = ("translate", "reverse", "format")
+    if (instrumented != correct or
+            report["write"]["bytes"] != len(correct) or
+            report["read"]["bytes"] < input_size or
+            not all(report[stage]["bytes"] for stage in computed)):
+        failures.append("stats")
+    # The bulk engines of short records and FASTQ are timed too.
+    fastq_input = b"@a\nACGTT\n+a\nABCDE\n@b\nGGC\n+\nFGH\n"
+    for inp, kwargs in ((reads, {}), (fastq_input, {"fastq": True})):
+        with patched("STATS", revcomp.Stats()):
+            run(io.BytesIO(inp), **kwargs)
+            report = revcomp.STATS.report()
+        if not all(report[stage]["bytes"] for stage in computed):
+            failures.append(f"stats {'fastq' if kwargs else 'short records'}")
+    # Input that starts with "x" is only zlib when the header checks out.
+    if run(io.BytesIO(b"x\nACGT\n")) != b"x\nACGT\n":
+        failures.append("zlib header")
+    short_records = run(io.BytesIO(b">a\nACGT\n>b\nAC\n>c\n\n"))
+    if short_records != b">a\nACGT\n>b\nGT\n>c\n":
+        failures.append("short records")
+    # Files of a batch are done by a pool of processes, failing ones are
+    # reported without stopping the others.
+    with tempfile.TemporaryDirectory() as batch_dir:
+        jobs = [("revcomp-input.txt", batch_dir + "/good.fa")]
+        with open(batch_dir + "/bad.fa", "wb") as bad:
+            bad.write(b">a")
+        jobs.append((batch_dir + "/bad.fa", batch_dir + "/bad.rc.fa"))
+        jobs.append((batch_dir + "/missing.fa", batch_dir + "/missing.rc.fa"))
+        batch = {result.input_path: result for result in
+                 revcomp_batch.reverse_complement_files(jobs, workers=2)}
+        with open(batch_dir + "/good.fa", "rb") as result:
+            if (result.read() != correct or
+                    batch["revcomp-input.txt"].error is not None):
+                failures.append("batch")
+        if (not isinstance(batch[batch_dir + "/bad.fa"].error, EOFError) or
+                os.path.exists(batch_dir + "/bad.rc.fa") or
+                os.path.exists(batch_dir + "/bad.rc.fa.partial")):
+            failures.append("batch error")
+        if not isinstance(batch[batch_dir + "/missing.fa"].error,
+                          FileNotFoundError):
+            failures.append("batch missing file")
+        # Inputs with the same name in different directories would
+        # overwrite each other's output in one output directory.
+        duplicate = subprocess.run(
+            [sys.executable, "revcomp_batch.py", "-o", batch_dir,
+             batch_dir + "/s1/reads.fa", batch_dir + "/s2/reads.fa"],
+            stderr=subprocess.PIPE)
+        if duplicate.returncode != 2 or b"reads.rc.fa" not in duplicate.stderr:
+            failures.append("batch duplicate outputs")
+        # An output may not overwrite any input, whether it is the input
+        # itself or the output of a previous run that is given as an input.
+        for inputs, manifest in ((["-f", "-"], b"bad.fa\tbad.fa\n"),
+                                 (["good.fa", "good.rc.fa"], b"")):
+            with open(batch_dir + "/good.rc.fa", "wb") as previous:
+                previous.write(b">a\nACGT\n")
+            overwrite = subprocess.run(
+                [sys.executable, os.path.abspath("revcomp_batch.py")] +
+                inputs, cwd=batch_dir, input=manifest, stderr=subprocess.PIPE)
+            with open(batch_dir + "/good.rc.fa", "rb") as previous:
+                if (overwrite.returncode != 2 or
+                        not os.path.exists(batch_dir + "/bad.fa") or
+                        previous.read() != b">a\nACGT\n"):
+                    failures.append(f"batch overwrites {inputs[-1]}")
+    with tempfile.TemporaryDirectory() as socket_dir:
+        path = socket_dir + "/revcomp.sock"
+        server = subprocess.Popen([sys.executable, "reverse_complement.py",
+                                   "--serve", path, "--workers", "2"],
+                                  stderr=subprocess.DEVNULL)
+        try:
+            for _ in range(100):
+                if os.path.exists(path):
+                    break
+                time.sleep(0.05)
+            outp = io.BytesIO()
+            with open("revcomp-input.txt", "rb") as inp:
+                revcomp_client.reverse_complement(path, inp, outp)
+            if outp.getvalue() != correct:
+                failures.append("server")
+            try:
+                revcomp_client.reverse_complement(
+                    path, io.BytesIO(b">a"), io.BytesIO())
+                failures.append("server error")
+            except RuntimeError:
+                pass
+        finally:
+            server.terminate()
+            server.wait()
+        if os.path.exists(path):
+            failures.append("server socket")
+    # The output of fasta_no5.py may not depend on how it is parallelized.
+    # Pretending there are many CPUs runs the parallel paths on any machine:
+    # pwrite when the output is a file and locks when it is a pipe.
+    fasta_digests = {0: "4d522cca8c3091af8ef1471d3b1265ea",
+                     1: "367ac00b110aadfb5277525d0d98a097",
+                     29: "2fecf5679a888e07a3868bbd1afa94ec",
+                     200: "7248b31d25501f79945f49cf0ce29b67",
+                     1000: "60cbd78a7793bcc8032ef153b4a37b56"}
+    fasta_no5 = ("import os, runpy; os.cpu_count = lambda: 64; "
+                 "runpy.run_path('benchmarks/fasta_no5.py', "
+                 "run_name='__main__')")
+    for n, digest in fasta_digests.items():
+        command = [sys.executable, "-c", fasta_no5, str(n)]
+        with tempfile.TemporaryFile() as outp:
+            subprocess.run(command, stdout=outp, check=True)
+            outp.seek(0)
+            if hashlib.md5(outp.read()).hexdigest() != digest:
+                failures.append(f"fasta_no5 file {n}")
+        piped = subprocess.run(command, stdout=subprocess.PIPE, check=True)
+        if hashlib.md5(piped.stdout).hexdigest() != digest:
+            failures.append(f"fasta_no5 pipe {n}")
+    # A profile with a block size that is not positive is ignored.
+    with tempfile.TemporaryDirectory() as cache_dir, \
+            unittest.mock.patch.dict(os.environ, XDG_CACHE_HOME=cache_dir):
+        os.environ.pop("REVCOMP_BLOCK_SIZE", None)
+        profile_path = revcomp.calibration_profile_path()
+        os.makedirs(os.path.dirname(profile_path))
+        for block_size in (0, -1):
+            with open(profile_path, "wt") as profile:
+                json.dump({"block_size": block_size}, profile)
+            if revcomp._configured_block_size() != revcomp.DEFAULT_BLOCK_SIZE:
+                failures.append(f"profile block size {block_size}")
+    if failures:
+        print("Failure!", ", ".join(failures))
+        sys.exit(1)
+    print("Sucess!")